@@ -0,0 +1,82 @@
+"""
+Benchmark of the record codec against JSON.
+
+Encodes and decodes a set of sample transactions with both
+codec.TRANSACTION and json, then reports the average record
+size and the time per record.
+
+Usage:
+    python3 bench_codec.py [record_count]
+"""
+
+import json
+import sys
+import time
+
+sys.path.insert(0, '../software')
+import codec
+
+
+def sample_transactions(count):
+    """ Returns count transaction tuples shaped like the ones
+        stored by the terminal.
+    """
+    records = []
+    for i in range(count):
+        records.append((
+            1718000000 + i * 37,
+            (i * 7919) % 500000 - (1000 if i % 50 == 0 else 0),
+            bytes(((i * 13 + j) & 0xff) for j in range(7)),
+            'INV-%06d' % i,
+        ))
+    return records
+
+
+def as_json(record):
+    """ Returns the JSON text a record is stored as today.
+    """
+    timestamp, amount, card_uid, reference = record
+    return json.dumps({
+        'timestamp': timestamp,
+        'amount': amount,
+        'card_uid': card_uid.hex(),
+        'reference': reference,
+    }).encode()
+
+
+def from_json(data):
+    """ Parses a JSON record back into a tuple.
+    """
+    obj = json.loads(data)
+    return (obj['timestamp'], obj['amount'],
+            bytes.fromhex(obj['card_uid']), obj['reference'])
+
+
+def timed(function, items):
+    """ Runs function over items and returns the results
+        and the time per item in microseconds.
+    """
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    elapsed = time.perf_counter() - start
+    return results, elapsed * 1e6 / len(items)
+
+
+def main(count=10000):
+    records = sample_transactions(count)
+    print('%d records' % count)
+    print('%-8s %10s %12s %12s' % ('format', 'bytes/rec', 'encode us', 'decode us'))
+    for name, encode, decode in (
+            ('json', as_json, from_json),
+            ('codec', codec.encode, codec.decode)):
+        encoded, encode_us = timed(encode, records)
+        decoded, decode_us = timed(decode, encoded)
+        size = sum(len(data) for data in encoded) / count
+        # decoded bytes fields may be memoryviews
+        assert [tuple(bytes(v) if isinstance(v, memoryview) else v for v in d)
+                for d in decoded] == records
+        print('%-8s %10.1f %12.2f %12.2f' % (name, size, encode_us, decode_us))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
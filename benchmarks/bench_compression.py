@@ -0,0 +1,54 @@
+"""
+Benchmark of the value compression used by database namespaces.
+
+Compresses sample records in the formats the terminal stores
+(codec.TRANSACTION records, the JSON records written before the
+codec, JSON upload batches) and
+reports, from compression.stats, the stored size relative to
+the original and the time per record, so the flash saved can
+be weighed against the CPU cost for each threshold.
+
+Usage:
+    python3 bench_compression.py [record_count] [threshold]
+"""
+
+import json
+import sys
+
+sys.path.insert(0, '../software')
+import codec
+import compression
+from bench_codec import as_json, sample_transactions
+
+
+def batch(records):
+    """ Returns the JSON upload payload for a few transactions.
+    """
+    return json.dumps({'terminal_id': 'T0001', 'transactions': [{
+        'timestamp': timestamp, 'amount': amount,
+        'card_uid': card_uid.hex(), 'reference': reference}
+        for timestamp, amount, card_uid, reference in records]}).encode()
+
+
+def main(count=2000, threshold=compression.THRESHOLD):
+    records = sample_transactions(count)
+    kinds = (
+        ('codec', [codec.encode(record, codec.TRANSACTION) for record in records]),
+        ('json', [as_json(record) for record in records]),
+        ('batch', [batch(records[i:i + 4]) for i in range(0, count, 4)]),
+    )
+    print('threshold %d bytes' % threshold)
+    print('%-8s %8s %10s %8s %12s %12s' % ('kind', 'values', 'bytes/rec',
+                                          'ratio', 'compress us', 'decomp. us'))
+    for name, values in kinds:
+        compression.stats.reset()
+        stored = [compression.compress(value, threshold) for value in values]
+        assert [compression.decompress(value) for value in stored] == values
+        stats = compression.stats
+        print('%-8s %8d %10.1f %8.2f %12.1f %12.1f' % (
+            name, len(values), stats.bytes_in / len(values), stats.ratio(),
+            stats.compress_us / len(values), stats.decompress_us / len(values)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,131 @@
+"""
+Benchmark of the database module on CPython.
+
+Fills a store with a given number of records, then replays a
+workload of appends, dequeues and counts against it and reports
+the time per operation. The same workload is replayed at every
+store size; an operation whose time grows with the store size
+(more than --limit times between the smallest and the largest
+store) is reported and the script exits with status 1, so O(n)
+regressions are caught before they reach a terminal.
+
+A workload file holds one operation per line:
+
+    append <records>
+    dequeue <records>
+    count
+
+Usage:
+    python3 bench_database.py [--sizes 1000,10000,100000]
+                              [--workload file] [--limit 4]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, '../software')
+import database
+
+DATABASE_FILE = 'bench.db'
+# record shaped like an encoded transaction (see codec.py)
+RECORD = b'\x01\x80\xe4\xd7\xb3\x06\xa8\x27\x07\x04\xa2\x1b\x9c\x11\x22\x33\x0aINV-000001'
+# store-and-forward loop: queue a sale, show the pending
+# count, forward the oldest record
+DEFAULT_WORKLOAD = [('append', 1), ('count', 0), ('dequeue', 1)] * 100
+
+
+def load_workload(path):
+    """ Reads a workload file.
+
+    Returns:
+        (list) (operation, records) tuples
+    """
+    workload = []
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            records = int(fields[1]) if len(fields) > 1 else 0
+            workload.append((fields[0], records))
+    return workload
+
+
+def fill(size):
+    """ Creates a fresh store holding size records.
+    """
+    for name in (DATABASE_FILE, DATABASE_FILE + '.tmp', DATABASE_FILE + '.jnl'):
+        if os.path.exists(name):
+            os.remove(name)
+    with database.Database(DATABASE_FILE) as db:
+        for start in range(0, size, 1000):
+            db.begin()
+            db.put([RECORD] * min(1000, size - start))
+            db.commit()
+
+
+def replay(workload):
+    """ Runs a workload through the module functions (one open
+        per call, as the terminal code does).
+
+    Returns:
+        (dict) operation -> (calls, total seconds)
+    """
+    timings = {}
+    for operation, records in workload:
+        start = time.perf_counter()
+        if operation == 'append':
+            database.update_database([RECORD] * records, DATABASE_FILE)
+        elif operation == 'dequeue':
+            database.get_values(records, DATABASE_FILE)
+        elif operation == 'count':
+            database.get_inventory(DATABASE_FILE)
+        else:
+            raise ValueError('unknown operation %r' % operation)
+        elapsed = time.perf_counter() - start
+        calls, total = timings.get(operation, (0, 0.0))
+        timings[operation] = (calls + 1, total + elapsed)
+    return timings
+
+
+def main(argv):
+    sizes = [1000, 10000, 100000]
+    workload = DEFAULT_WORKLOAD
+    limit = 4.0
+    args = list(argv)
+    while args:
+        option = args.pop(0)
+        if option == '--sizes':
+            sizes = [int(size) for size in args.pop(0).split(',')]
+        elif option == '--workload':
+            workload = load_workload(args.pop(0))
+        elif option == '--limit':
+            limit = float(args.pop(0))
+        else:
+            print(__doc__)
+            return 2
+    results = {}
+    print('%10s %10s %8s %12s' % ('records', 'operation', 'calls', 'us/call'))
+    for size in sizes:
+        fill(size)
+        timings = replay(workload)
+        for operation in sorted(timings):
+            calls, total = timings[operation]
+            results[(size, operation)] = total * 1e6 / calls
+            print('%10d %10s %8d %12.1f' % (size, operation, calls,
+                                            results[(size, operation)]))
+    os.remove(DATABASE_FILE)
+    os.remove(DATABASE_FILE + '.jnl')
+    status = 0
+    for operation in sorted(set(operation for _, operation in results)):
+        growth = results[(sizes[-1], operation)] / results[(sizes[0], operation)]
+        print('%s: %.1fx from %d to %d records' % (operation, growth, sizes[0], sizes[-1]))
+        if growth > limit:
+            print('  grows with the store size (limit %.1fx)' % limit)
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,111 @@
+"""
+Benchmark of the GSM/GPRS code against the SIM808 emulator.
+
+Runs the modules of the software folder unchanged on CPython,
+with sim808_emulator in place of the module and the network, and
+reports the wall time per HTTPS request (AT+HTTP* GET and POST,
+and the AT+CIPSEND path) and per SMS, along with the failures
+and the errors and lost replies injected. Latencies are per
+reply, so the figures show how much time the code itself adds
+to what the module and the network take.
+
+Usage:
+    python3 bench_modem.py [--count 10] [--latency 0.02]
+                           [--network-latency 0.5]
+                           [--sms-latency 2] [--baud 115200]
+                           [--loss 0] [--error-rate 0]
+                           [--body 2048]
+"""
+
+import argparse
+import sys
+import time
+
+from sim808_emulator import Sim808, install
+
+sys.path.insert(0, '../software')
+
+
+def timed(function, *args, **kwargs):
+    """ Runs function and returns its result and wall time (sec).
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(name, times, failures):
+    """ Prints the wall time figures of one kind of operation.
+    """
+    if not times:
+        return
+    print('%-12s %6d %8d %10.3f %10.3f %10.3f' % (
+        name, len(times), failures, sum(times) / len(times), min(times), max(times)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--network-latency', type=float, default=0.5)
+    parser.add_argument('--sms-latency', type=float, default=2.0)
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--body', type=int, default=2048)
+    options = parser.parse_args()
+
+    body = b'x' * options.body
+
+    def server(method, url, data):
+        return 200, body
+
+    emulator = install(Sim808(
+        latency=options.latency, network_latency=options.network_latency,
+        sms_latency=options.sms_latency, baud=options.baud, loss=options.loss,
+        error_rate=options.error_rate, server=server))
+    import gprs
+    import sim808
+    import sms
+
+    gsm_uart, setup = timed(sim808.init_sim808)
+    registered, elapsed = timed(sim808.register_network, gsm_uart)
+    print('setup %.3f s, registration %.3f s (%s)' % (setup, elapsed, registered))
+
+    results = {'https GET': [], 'https POST': [], 'cipsend GET': [], 'sms': []}
+    failures = dict((name, 0) for name in results)
+    for i in range(options.count):
+        response, elapsed = timed(gprs.https_request, gsm_uart, 'GET',
+                                  'https://example.com/orders/%d' % i)
+        results['https GET'].append(elapsed)
+        if response is None or response[0] != 200 or response[2] != body:
+            failures['https GET'] += 1
+        response, elapsed = timed(gprs.https_request, gsm_uart, 'POST',
+                                  'https://example.com/orders', data='{"order": %d}' % i)
+        results['https POST'].append(elapsed)
+        if response is None or response[0] != 200:
+            failures['https POST'] += 1
+
+        start = time.perf_counter()
+        connected = gprs.init_simcom_http(gsm_uart)
+        data = gprs.send_simcom_http_query(gsm_uart, b'/orders/%d' % i) if connected else b''
+        results['cipsend GET'].append(time.perf_counter() - start)
+        if gprs.extract_http_payload(data) != body:
+            failures['cipsend GET'] += 1
+
+        sms.init_sms('Payment %d received' % i, '+256700000000')
+        status, elapsed = timed(sms.send_sms)
+        results['sms'].append(elapsed)
+        if status != sms.SUCCESS:
+            failures['sms'] += 1
+
+    print('%-12s %6s %8s %10s %10s %10s' % ('operation', 'count', 'failed',
+                                            'mean s', 'min s', 'max s'))
+    for name in results:
+        report(name, results[name], failures[name])
+    print('%d commands, %d errors injected, %d replies lost' % (
+        emulator.commands, emulator.errors, emulator.lost))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,549 @@
+"""
+SIM808 emulator for running gprs, sim808 and sms on CPython.
+
+Sim808 answers the subset of AT commands those modules use:
+
+    AT, ATE, CFUN, CSCLK, CSQ, CREG, CGATT, CBC
+    SAPBR, HTTPINIT, HTTPTERM, HTTPPARA, HTTPSSL, HTTPDATA,
+    HTTPACTION, HTTPREAD
+    CSTT, CIICR, CIFSR, CIPSSL, CIPSTART, CIPSEND, CIPCLOSE,
+    CIPSHUT
+    CMGF, CMGS, CMGL, CMGR
+    CNTPCID, CNTP, CCLK
+
+Replies are timed like the real module: each one is ready after
+the command latency (the network latency for +HTTPACTION,
+CONNECT OK, +CMGS and +CNTP results) plus the time to send it at
+the baud rate. A reply may be lost (loss) or replaced by an
+error (error_rate): ERROR, a 601 +HTTPACTION status or CONNECT
+FAIL. HTTP requests are answered by server(method, url, data),
+returning the status and body.
+
+install() puts a fake machine module (UART, Pin), pttconfigure
+and the MicroPython time functions in place, so the modules in
+the software folder run against the emulator unchanged;
+serve_pty() puts it behind a pty instead, for modem_async.
+
+Usage:
+    emulator = sim808_emulator.install(Sim808(latency=0.05))
+    sys.path.insert(0, '../software')
+    import gprs
+    status, length, body = gprs.https_request(modem.get_modem(), 'GET', url)
+"""
+
+import os
+import random
+import re
+import select
+import sys
+import threading
+import time
+import types
+
+IP_ADDRESS = b'10.64.0.2'
+
+
+def default_server(method, url, data):
+    """ Answers every request with a small JSON body.
+    """
+    return 200, b'{"method": "%s", "url": "%s", "length": %d}' % (
+        method.encode(), url.encode(), len(data or b''))
+
+
+class Sim808:
+    """ Scriptable SIM808 module.
+
+    Parameters:
+        latency (float): time (sec) to answer a command
+        network_latency (float): time (sec) for results that go
+                                 over the network
+        sms_latency (float): time (sec) to send an SMS
+        baud (int): UART baud rate (0 for no transfer time)
+        loss (float): probability of a reply being lost
+        error_rate (float): probability of a command failing
+        echo (bool): echo the commands (ATE1)
+        register_after (float): time (sec) until registration
+        server (function): server(method, url, data) -> (status,
+                           body) for HTTP requests
+        seed (int): seed of the loss and error draws
+    """
+
+    def __init__(self, latency=0.02, network_latency=0.5, sms_latency=2.0,
+                 baud=115200, loss=0.0, error_rate=0.0, echo=True,
+                 register_after=0.0, server=default_server, seed=0):
+        self.latency = latency
+        self.network_latency = network_latency
+        self.sms_latency = sms_latency
+        self.baud = baud
+        self.loss = loss
+        self.error_rate = error_rate
+        self.echo = echo
+        self.server = server
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.registered_at = time.monotonic() + register_after
+        # (ready time, bytes) waiting to be read
+        self._out = []
+        # time the UART is done sending the last queued reply
+        self._line_free = 0.0
+        # bytes written and not handled yet
+        self._in = b''
+        # None, or what the written bytes are for: 'httpdata',
+        # 'cipsend' or 'cmgs'
+        self._mode = None
+        self._data_length = 0
+        self._sms_number = None
+        self.bearer = False
+        self.http_init = False
+        self.http_params = {}
+        self.http_data = b''
+        self.http_body = b''
+        self.ip_up = False
+        self.connected = False
+        # (number, text) of the messages sent and received
+        self.sent = []
+        self.inbox = []
+        # commands handled, replies lost, errors injected
+        self.commands = 0
+        self.lost = 0
+        self.errors = 0
+
+    # output side
+
+    def _queue(self, data, delay=None):
+        """ Queues a reply, ready after delay (latency by default)
+            and the time to send it.
+        """
+        if delay is None:
+            delay = self.latency
+        if self.loss and self._random.random() < self.loss:
+            self.lost += 1
+            return
+        ready = max(time.monotonic() + delay, self._line_free)
+        if self.baud:
+            ready += len(data) * 10 / self.baud
+        self._line_free = ready
+        self._out.append((ready, data))
+        self._out.sort(key=lambda item: item[0])
+
+    def _reply(self, *lines, delay=None):
+        """ Queues result lines framed as by the module.
+        """
+        self._queue(b''.join(b'\r\n' + line + b'\r\n' for line in lines), delay)
+
+    def _fail(self):
+        """ Whether to inject an error into this command.
+        """
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    def ready(self):
+        """ Returns the number of bytes ready to be read.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return sum(len(data) for ready, data in self._out if ready <= now)
+
+    def next_ready(self):
+        """ Returns when the next reply is ready (None if none).
+        """
+        with self._lock:
+            return self._out[0][0] if self._out else None
+
+    def read(self, count):
+        """ Takes up to count of the bytes ready.
+        """
+        with self._lock:
+            now = time.monotonic()
+            data = b''
+            while self._out and self._out[0][0] <= now and len(data) < count:
+                ready, chunk = self._out.pop(0)
+                take = count - len(data)
+                if len(chunk) > take:
+                    self._out.insert(0, (ready, chunk[take:]))
+                    chunk = chunk[:take]
+                data += chunk
+            return data
+
+    def deliver_sms(self, number, text):
+        """ Stores an incoming message and sends its +CMTI.
+        """
+        if isinstance(number, str):
+            number = number.encode()
+        if isinstance(text, str):
+            text = text.encode()
+        with self._lock:
+            self.inbox.append((number, text))
+            self._reply(b'+CMTI: "SM",%d' % len(self.inbox), delay=0)
+
+    # input side
+
+    def write(self, data):
+        """ Handles bytes written to the module.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        with self._lock:
+            self._in += bytes(data)
+            while self._in:
+                if self._mode is None:
+                    end = self._in.find(b'\r')
+                    if end < 0:
+                        break
+                    line = self._in[:end]
+                    self._in = self._in[end + 1:].lstrip(b'\n')
+                    if line.strip():
+                        self._command(line.strip())
+                elif not self._data():
+                    break
+
+    def _data(self):
+        """ Handles the data following DOWNLOAD or a > prompt.
+
+        Returns:
+            (boolean) whether all of it arrived
+        """
+        if self._mode == 'httpdata':
+            if len(self._in) < self._data_length:
+                return False
+            self.http_data = self._in[:self._data_length]
+            self._in = self._in[self._data_length:]
+            self._mode = None
+            self._reply(b'OK')
+            return True
+        end = self._in.find(b'\x1a')
+        if end < 0:
+            return False
+        data = self._in[:end]
+        self._in = self._in[end + 1:]
+        mode = self._mode
+        self._mode = None
+        if mode == 'cmgs':
+            if self._fail():
+                self._reply(b'+CMS ERROR: 500', delay=self.sms_latency)
+            else:
+                self.sent.append((self._sms_number, data))
+                self._reply(b'+CMGS: %d' % len(self.sent), b'OK', delay=self.sms_latency)
+        else:
+            self._reply(b'SEND OK')
+            self._tcp_response(data)
+        return True
+
+    def _tcp_response(self, request):
+        """ Answers an HTTP/1.0 request sent with AT+CIPSEND, then
+            closes the connection.
+        """
+        match = re.match(rb'(\w+) (\S+) HTTP', request.lstrip())
+        if match is None:
+            status, body = 400, b''
+            method = b'GET'
+        else:
+            method, path = match.groups()
+            status, body = self.server(method.decode(), path.decode(),
+                                       request.split(b'\r\n\r\n', 1)[-1].strip())
+        self._queue(b'HTTP/1.1 %d OK\r\nContent-Length: %d\r\n\r\n' % (status, len(body))
+                    + body + b'\r\nCLOSED\r\n', self.network_latency)
+        self.connected = False
+
+    def _command(self, line):
+        """ Handles one command line.
+        """
+        self.commands += 1
+        if self.echo:
+            self._queue(line + b'\r', 0)
+        upper = line.upper()
+        if not upper.startswith(b'AT'):
+            self._reply(b'ERROR')
+            return
+        name, _, args = upper[2:].partition(b'=')
+        # keep the case of the arguments (URLs, text)
+        args = line[len(line) - len(args):] if args else b''
+        if name in (b'', b'E0', b'E1', b'+CFUN', b'+CSCLK', b'+CMGF', b'+CNTPCID',
+                    b'+HTTPSSL', b'+CIPSSL', b'+CSTT'):
+            self._reply(b'OK')
+            return
+        if self._fail():
+            if name == b'+HTTPACTION' and self.bearer and self.http_init:
+                self._reply(b'OK')
+                self._reply(b'+HTTPACTION: %s,601,0' % args[:1], delay=self.network_latency)
+            elif name == b'+CIPSTART':
+                self._reply(b'OK')
+                self._reply(b'CONNECT FAIL', delay=self.network_latency)
+            else:
+                self._reply(b'ERROR')
+            return
+        handler = getattr(self, '_at_' + name.decode().strip('+?').lower(), None)
+        if handler is None:
+            self._reply(b'ERROR')
+        else:
+            handler(name.endswith(b'?'), args)
+
+    def _registered(self):
+        return time.monotonic() >= self.registered_at
+
+    # commands, called with whether it is a query and the arguments
+
+    def _at_csq(self, query, args):
+        self._reply(b'+CSQ: 20,0', b'OK')
+
+    def _at_creg(self, query, args):
+        self._reply(b'+CREG: 0,%d' % (1 if self._registered() else 2), b'OK')
+
+    def _at_cgatt(self, query, args):
+        self._reply(b'+CGATT: %d' % self._registered(), b'OK')
+
+    def _at_cbc(self, query, args):
+        self._reply(b'+CBC: 0,85,4100', b'OK')
+
+    def _at_sapbr(self, query, args):
+        command = args.split(b',')[0]
+        if command == b'2':
+            if self.bearer:
+                self._reply(b'+SAPBR: 1,1,"%s"' % IP_ADDRESS, b'OK')
+            else:
+                self._reply(b'+SAPBR: 1,3,"0.0.0.0"', b'OK')
+        elif command == b'1':
+            if not self._registered():
+                self._reply(b'ERROR', delay=self.network_latency)
+                return
+            self.bearer = True
+            self._reply(b'OK', delay=self.network_latency)
+        elif command == b'0':
+            self.bearer = False
+            self.http_init = False
+            self._reply(b'OK')
+        else:
+            self._reply(b'OK')
+
+    def _at_httpinit(self, query, args):
+        if self.http_init or not self.bearer:
+            self._reply(b'ERROR')
+            return
+        self.http_init = True
+        self.http_params = {}
+        self._reply(b'OK')
+
+    def _at_httpterm(self, query, args):
+        ok = self.http_init
+        self.http_init = False
+        self._reply(b'OK' if ok else b'ERROR')
+
+    def _at_httppara(self, query, args):
+        if not self.http_init:
+            self._reply(b'ERROR')
+            return
+        name, _, value = args.partition(b',')
+        self.http_params[name.strip(b' "').upper()] = value.strip(b' "')
+        self._reply(b'OK')
+
+    def _at_httpdata(self, query, args):
+        self._data_length = int(args.split(b',')[0])
+        self._mode = 'httpdata'
+        self._reply(b'DOWNLOAD')
+
+    def _at_httpaction(self, query, args):
+        if not (self.bearer and self.http_init):
+            self._reply(b'ERROR')
+            return
+        method = 'POST' if args[:1] == b'1' else 'GET'
+        data = self.http_data if method == 'POST' else None
+        status, self.http_body = self.server(
+            method, self.http_params.get(b'URL', b'').decode(), data)
+        self._reply(b'OK')
+        delay = self.network_latency
+        if self.baud:
+            # the body comes over the air before the result
+            delay += len(self.http_body) * 10 / self.baud
+        self._reply(b'+HTTPACTION: %s,%d,%d' % (args[:1], status, len(self.http_body)),
+                    delay=delay)
+
+    def _at_httpread(self, query, args):
+        if not self.http_init:
+            self._reply(b'ERROR')
+            return
+        offset, length = 0, len(self.http_body)
+        if args:
+            offset, length = [int(arg) for arg in args.split(b',')]
+        chunk = self.http_body[offset:offset + length]
+        self._queue(b'\r\n+HTTPREAD: %d\r\n' % len(chunk) + chunk + b'\r\nOK\r\n')
+
+    def _at_ciicr(self, query, args):
+        self.ip_up = self._registered()
+        self._reply(b'OK' if self.ip_up else b'ERROR', delay=self.network_latency)
+
+    def _at_cifsr(self, query, args):
+        if self.ip_up:
+            self._queue(b'\r\n' + IP_ADDRESS + b'\r\n')
+        else:
+            self._reply(b'ERROR')
+
+    def _at_cipstart(self, query, args):
+        if self.connected:
+            self._reply(b'ALREADY CONNECT')
+            return
+        self._reply(b'OK')
+        self.connected = True
+        self._reply(b'CONNECT OK', delay=self.network_latency)
+
+    def _at_cipsend(self, query, args):
+        if not self.connected:
+            self._reply(b'ERROR')
+            return
+        self._mode = 'cipsend'
+        self._queue(b'\r\n> ')
+
+    def _at_cipclose(self, query, args):
+        self.connected = False
+        self._reply(b'CLOSE OK')
+
+    def _at_cipshut(self, query, args):
+        self.connected = False
+        self.ip_up = False
+        self._reply(b'SHUT OK')
+
+    def _at_cmgs(self, query, args):
+        if not self._registered():
+            self._reply(b'+CMS ERROR: 331')
+            return
+        self._sms_number = args.strip(b'"')
+        self._mode = 'cmgs'
+        self._queue(b'\r\n> ')
+
+    def _at_cmgl(self, query, args):
+        lines = []
+        for index, (number, text) in enumerate(self.inbox):
+            lines.append(b'+CMGL: %d,"REC READ","%s","",""\r\n%s' % (
+                index + 1, number, text))
+        self._reply(*(lines + [b'OK']))
+
+    def _at_cmgr(self, query, args):
+        index = int(args) - 1
+        if not 0 <= index < len(self.inbox):
+            self._reply(b'+CMS ERROR: 321')
+            return
+        number, text = self.inbox[index]
+        self._reply(b'+CMGR: "REC READ","%s","",""\r\n%s' % (number, text), b'OK')
+
+    def _at_cntp(self, query, args):
+        self._reply(b'OK')
+        if not args:
+            self._reply(b'+CNTP: 1', delay=self.network_latency)
+
+    def _at_cclk(self, query, args):
+        now = time.gmtime()
+        self._reply(b'+CCLK: "%02d/%02d/%02d,%02d:%02d:%02d+00"' % (
+            now.tm_year % 100, now.tm_mon, now.tm_mday,
+            now.tm_hour, now.tm_min, now.tm_sec), b'OK')
+
+
+class UART:
+    """ machine.UART over the installed emulator.
+    """
+
+    emulator = None
+
+    def __init__(self, *args, **kwargs):
+        self.emulator = UART.emulator
+
+    def write(self, data):
+        self.emulator.write(data)
+        return len(data)
+
+    def readinto(self, buffer, count=None):
+        buffer = memoryview(buffer)
+        if count is not None:
+            buffer = buffer[:count]
+        data = self.emulator.read(len(buffer))
+        if not data:
+            return None
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read(self, count=4096):
+        return self.emulator.read(count) or None
+
+    def any(self):
+        return self.emulator.ready()
+
+
+class Pin:
+    """ machine.Pin doing nothing.
+    """
+
+    OUT = 1
+    IN = 0
+
+    def __init__(self, pin, mode=None):
+        self._value = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+
+def install(emulator=None, config=None):
+    """ Puts the fake machine and pttconfigure modules and the
+        MicroPython time functions in place (before the software
+        modules are imported).
+
+    Parameters:
+        emulator (Sim808): module behind UART() (a new one by
+                           default)
+        config (dict): pttconfigure parameters
+
+    Returns:
+        (Sim808) the emulator
+    """
+    if emulator is None:
+        emulator = Sim808()
+    UART.emulator = emulator
+    machine = types.ModuleType('machine')
+    machine.UART = UART
+    machine.Pin = Pin
+    sys.modules['machine'] = machine
+    settings = {'server_ip_address': b'127.0.0.1'}
+    settings.update(config or {})
+    pttconfigure = types.ModuleType('pttconfigure')
+    pttconfigure.get_conf_param = settings.get
+    sys.modules['pttconfigure'] = pttconfigure
+    if not hasattr(time, 'ticks_ms'):
+        time.ticks_ms = lambda: int(time.monotonic() * 1000)
+        time.ticks_us = lambda: int(time.monotonic() * 1000000)
+        time.ticks_diff = lambda end, start: end - start
+        time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+        time.sleep_us = lambda us: time.sleep(us / 1000000)
+    return emulator
+
+
+def serve_pty(emulator):
+    """ Runs the emulator behind a pty, in a thread.
+
+    Returns:
+        (str) path of the pty to open (e.g. with
+              modem_async.open_serial())
+    """
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+
+    def serve():
+        while True:
+            ready_at = emulator.next_ready()
+            timeout = None if ready_at is None else max(0, ready_at - time.monotonic())
+            readable, _, _ = select.select([master], [], [], timeout)
+            if readable:
+                try:
+                    emulator.write(os.read(master, 1024))
+                except OSError:
+                    return
+            data = emulator.read(4096)
+            if data:
+                os.write(master, data)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return os.ttyname(slave)
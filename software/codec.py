@@ -0,0 +1,181 @@
+"""
+Compact binary codec for stored records.
+
+A record is a tuple of values laid out according to a schema.
+The encoded form starts with the schema version byte, followed
+by the fields in order:
+
+    u   unsigned integer, varint
+    i   signed integer, zigzag varint
+    f   float, 4 bytes little endian
+    b   bytes, varint length + data
+    s   str, varint length + utf-8 data
+
+Decoding reads the version byte to pick the schema, so records
+written with an older schema stay readable after a new one is
+registered. Bytes fields are decoded as memoryview slices of
+the input, so no copy of the payload is made.
+
+Usage:
+    data = codec.encode((1718000000, 2500, b'\x04\xa2\x1b\x9c', 'INV-1'))
+    timestamp, amount, card_uid, reference = codec.decode(data)
+"""
+
+import struct
+
+
+# version byte -> Schema
+_schemas = {}
+
+
+class Schema:
+    """ Layout of an encoded record.
+
+    Parameters:
+        version (int): schema version byte (0-255)
+        fields (str): one type code per field (see module doc)
+    """
+
+    def __init__(self, version, fields):
+        for code in fields:
+            if code not in 'uifbs':
+                raise ValueError('unknown field type %r' % code)
+        self.version = version
+        self.fields = fields
+
+    def encode(self, values):
+        """ Encodes a tuple of values.
+
+        Parameters:
+            values (tuple): one value per schema field
+
+        Returns:
+            (bytes) encoded record
+        """
+        if len(values) != len(self.fields):
+            raise ValueError('expected %d values' % len(self.fields))
+        buf = bytearray()
+        buf.append(self.version)
+        for code, value in zip(self.fields, values):
+            if code == 'u':
+                _put_varint(buf, value)
+            elif code == 'i':
+                # zigzag: small negative numbers stay small
+                _put_varint(buf, (value << 1) ^ (value >> 63))
+            elif code == 'f':
+                buf.extend(struct.pack('<f', value))
+            else:
+                if code == 's':
+                    value = value.encode('utf-8')
+                _put_varint(buf, len(value))
+                buf.extend(value)
+        return bytes(buf)
+
+    def decode(self, data, pos=1):
+        """ Decodes a record (after its version byte).
+
+        Parameters:
+            data (bytes|memoryview): encoded record
+            pos (int): offset of the first field
+
+        Returns:
+            (tuple) field values, bytes fields as memoryview
+        """
+        mv = memoryview(data)
+        values = []
+        for code in self.fields:
+            if code == 'f':
+                values.append(struct.unpack_from('<f', mv, pos)[0])
+                pos += 4
+                continue
+            value, pos = _get_varint(mv, pos)
+            if code == 'i':
+                value = (value >> 1) ^ -(value & 1)
+            elif code in 'bs':
+                end = pos + value
+                if end > len(mv):
+                    raise ValueError('truncated record')
+                value = mv[pos:end]
+                if code == 's':
+                    value = str(value, 'utf-8')
+                pos = end
+            values.append(value)
+        return tuple(values)
+
+
+def _put_varint(buf, value):
+    """ Appends an unsigned varint (7 bits per byte,
+        least significant group first).
+    """
+    if value < 0:
+        raise ValueError('negative value for unsigned field')
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _get_varint(mv, pos):
+    """ Reads an unsigned varint.
+
+    Returns:
+        (tuple) value and offset of the next byte
+    """
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(mv):
+            raise ValueError('truncated record')
+        byte = mv[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def register(schema):
+    """ Makes a schema available to decode().
+
+    Parameters:
+        schema (Schema): schema to register
+
+    Returns:
+        schema (Schema): the registered schema
+    """
+    _schemas[schema.version] = schema
+    return schema
+
+
+# stored transaction: timestamp (s), amount (cents, negative
+# for refunds), card UID as read by the NFC reader, reference
+TRANSACTION = register(Schema(1, 'uibs'))
+
+
+def encode(values, schema=TRANSACTION):
+    """ Encodes a record with the given schema.
+
+    Parameters:
+        values (tuple): one value per schema field
+        schema (Schema): record layout (default: TRANSACTION)
+
+    Returns:
+        (bytes) encoded record
+    """
+    return schema.encode(values)
+
+
+def decode(data):
+    """ Decodes a record with the schema named by its version byte.
+
+    Parameters:
+        data (bytes|memoryview): encoded record
+
+    Returns:
+        (tuple) field values, bytes fields as memoryview
+    """
+    try:
+        schema = _schemas[data[0]]
+    except KeyError:
+        raise ValueError('unknown schema version %d' % data[0])
+    return schema.decode(data)
@@ -0,0 +1,164 @@
+"""
+Compression of stored values.
+
+A compressed value starts with a tag byte:
+
+    0   stored as is
+    1   raw deflate
+
+Values shorter than the threshold, and values that would not
+shrink, are stored with tag 0, so tiny records cost one byte
+and no CPU time.
+
+No preset dictionary is used: MicroPython's deflate module
+cannot take one, and values written on the host must read on
+the device. Where there is no compressor at all (zlib only
+decompresses on older builds) every value is written with
+tag 0.
+
+The stats object counts values and bytes in and out, and the
+time spent, to weigh the flash saved against the CPU cost.
+
+Usage:
+    stored = compression.compress(receipt, threshold=64)
+    receipt = compression.decompress(stored)
+    print(compression.stats.ratio(), compression.stats.compress_us)
+"""
+
+import io
+import time
+try:
+    import zlib
+except ImportError:
+    zlib = None
+try:
+    # MicroPython 1.21+
+    import deflate
+except ImportError:
+    deflate = None
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+RAW = 0
+DEFLATE = 1
+
+# values shorter than this are not compressed (bytes)
+THRESHOLD = 64
+
+_HAS_ZLIB = zlib is not None and hasattr(zlib, 'compressobj')
+_HAS_DEFLATE = _HAS_ZLIB or (deflate is not None and hasattr(deflate, 'DeflateIO'))
+
+
+class Stats:
+    """ Counters of compress() and decompress() calls.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Sets every counter back to zero.
+        """
+        # values passed to compress() and those stored compressed
+        self.values = 0
+        self.compressed = 0
+        # bytes passed to compress() and bytes it returned
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # values passed to decompress()
+        self.decompressed = 0
+        # time spent compressing and decompressing (us)
+        self.compress_us = 0
+        self.decompress_us = 0
+
+    def ratio(self):
+        """ Returns the stored size over the original size
+            (1.0 before anything was compressed).
+
+        Returns:
+            (float) compression ratio
+        """
+        if not self.bytes_in:
+            return 1.0
+        return self.bytes_out / self.bytes_in
+
+
+stats = Stats()
+
+
+def _deflate(data):
+    """ Compresses data with raw deflate.
+
+    Returns:
+        (bytes) tag byte and compressed data
+    """
+    if _HAS_ZLIB:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        return bytes((DEFLATE,)) + compressor.compress(data) + compressor.flush()
+    stream = io.BytesIO()
+    stream.write(bytes((DEFLATE,)))
+    with deflate.DeflateIO(stream, deflate.RAW) as compressor:
+        compressor.write(data)
+    return stream.getvalue()
+
+
+def _inflate(data):
+    """ Decompresses raw deflate data (after the tag byte).
+    """
+    if zlib is not None:
+        return zlib.decompress(data, -15)
+    return deflate.DeflateIO(io.BytesIO(data), deflate.RAW).read()
+
+
+def compress(data, threshold=THRESHOLD):
+    """ Returns the tagged form of a value, compressed if it
+        is at least threshold bytes long and shrinks.
+
+    Parameters:
+        data (bytes): value to store
+        threshold (int): minimum size to try compressing
+                         (0 to store the value as is)
+
+    Returns:
+        (bytes) tag byte followed by the (compressed) value
+    """
+    stats.values += 1
+    stats.bytes_in += len(data)
+    if _HAS_DEFLATE and threshold and len(data) >= threshold:
+        start = ticks_us()
+        packed = _deflate(data)
+        stats.compress_us += ticks_diff(ticks_us(), start)
+        if len(packed) <= len(data):
+            stats.compressed += 1
+            stats.bytes_out += len(packed)
+            return packed
+    stats.bytes_out += len(data) + 1
+    return bytes((RAW,)) + data
+
+
+def decompress(data):
+    """ Returns the value stored in tagged form by compress().
+
+    Parameters:
+        data (bytes): tagged value
+
+    Returns:
+        (bytes) original value
+    """
+    tag = data[0]
+    if tag == RAW:
+        return bytes(data[1:])
+    if tag != DEFLATE:
+        raise ValueError('unknown compression tag %d' % tag)
+    stats.decompressed += 1
+    start = ticks_us()
+    value = _inflate(data[1:])
+    stats.decompress_us += ticks_diff(ticks_us(), start)
+    return value
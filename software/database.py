@@ -12,13 +12,1341 @@ keys in a given range).
 
 User can define and store an external storage
 binary file (database_file) to use as a custom database.
+
+Records are stored under zero-padded decimal keys
+("0000000001", "0000000002", ...) so that the byte order
+used by btree is also the insertion order, while keys
+starting with _META_PREFIX hold bookkeeping values (such as
+the last used sequence number) and always sort after the
+records. Files written with the older unpadded keys are
+rewritten the first time they are opened.
+
+A Database object keeps the file and the btree handle open
+for its whole lifetime, so the btree page cache survives
+between calls. Changes are flushed after every call, or once
+per transaction when they are grouped between begin() and
+commit(). The module level functions open a Database for a
+single call, as before.
+
+Erasing the whole database (truncate) writes a fresh empty
+btree to a temporary file and renames it over the old one,
+so it takes the same time for any number of records and the
+file shrinks back to its initial size.
+
+Several queues can share one file as namespaces: the records
+of namespace "outbox" live under "outbox/0000000001", ... and
+its counters under _META_PREFIX + "outbox/", so each namespace
+has its own count, range scans and truncate while the file,
+the btree cache and the flushes are shared. The Database
+object itself is the default namespace, whose keys carry no
+prefix.
+
+Secondary indexes are declared per file with declare_index().
+Each index entry is an empty record under _INDEX_PREFIX, the
+namespace prefix, the index name, the indexed value and the
+record sequence number, written and removed in the same
+flush as the record itself, so a lookup by value is a range
+scan instead of a walk over every record.
+
+A capacity (records and/or bytes over all namespaces) can be
+stored in the file with set_capacity(). Appends that would go
+over it first evict the oldest records of the namespaces named
+by the policy (e.g. receipts already uploaded), and fail with
+DatabaseFull when nothing more may be evicted. Since deleted
+records leave pages behind, compact_step() rewrites the file
+into a new one a slice at a time during idle periods (once
+more bytes were removed than are still stored), with changes
+made meanwhile written to both files.
+
+A namespace can store its values compressed (see
+compression.py and Namespace.set_compression()). Records put
+after compression is turned on carry a tag byte, and the
+sequence number of the first of them is kept with the
+namespace counters, so older records are still read as they
+are.
+
+Since records are put in time order, a sparse time marker is
+kept per namespace: the first record put in each hour writes
+_TIME_PREFIX, the namespace prefix and the start of the hour
+as key, with the record sequence number as value. A Retention
+object uses the markers to find the records older than a
+cutoff and purges them as one key range, a slice at a time,
+optionally appending them to a compressed archive file first.
+
+Changes go through a write-ahead journal (see journal.py)
+beside the file: each flush first makes the changes and a
+commit entry durable in the journal, then flushes the btree
+with the id of the commit and the journal size after it. On
+open, only the journal beyond that size is read, and the
+transactions committed there (i.e. whose btree flush was cut
+short) are replayed, so recovery time does not depend on the
+store size.
+
+On CPython, where the btree module does not exist, the pure
+Python implementation in pybtree is used instead.
 """
 
-import btree
+import os
+import struct
+import time
+import compression
+import journal
+try:
+    import btree
+except ImportError:
+    # not on MicroPython: use the pure Python implementation
+    import pybtree as btree
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+# reserved prefix for metadata records (sorts after every record key)
+_META_PREFIX = b'\xff'
+# counters of a namespace, stored under _META_PREFIX + namespace prefix
+# last sequence number handed out to a record
+_SEQ_NAME = b'seq'
+# number of records currently stored
+_COUNT_NAME = b'count'
+# bytes (keys and values) of the records currently stored
+_BYTES_NAME = b'bytes'
+# compression setting ("<first tagged sequence number> <threshold>")
+_COMPRESS_NAME = b'compress'
+# capacity policy, see Database.set_capacity()
+_CAPACITY_KEY = _META_PREFIX + b'capacity'
+# bytes of records removed since the file was last compacted
+_FREED_KEY = _META_PREFIX + b'freed'
+# id of the last transaction flushed to the btree and the size
+# of the journal after its commit entry ("<txid> <offset>")
+_TXID_KEY = _META_PREFIX + b'txid'
+# name standing for the default namespace in the capacity policy
+_DEFAULT_NAME = '.'
+# key format of the file (missing for files with unpadded keys)
+_VERSION_KEY = _META_PREFIX + b'version'
+_FORMAT_VERSION = b'1'
+# record keys are decimal numbers, so they fall within this range
+# (after the namespace prefix)
+_RECORD_START = b'0'
+_RECORD_END = b':'
+# number of digits in a record key
+_KEY_WIDTH = 10
+# reserved prefix for secondary index entries (sorts between
+# the record keys and the metadata records)
+_INDEX_PREFIX = b'\xfe'
+# reserved prefix for time markers (sorts before the index entries)
+_TIME_PREFIX = b'\xfd'
+# time covered by a marker (s)
+_TIME_BUCKET = 3600
+# separates a namespace name from the rest of its keys
+_NAMESPACE_SEP = b'/'
+# suffix of the file a truncated database is built in
+_TEMP_SUFFIX = '.tmp'
+# suffix of the file a database is compacted into
+_COMPACT_SUFFIX = '.cmp'
+# suffix of the write-ahead journal
+_JOURNAL_SUFFIX = '.jnl'
+# compact once more bytes were removed than are stored ...
+# ... and at least this many
+_COMPACT_MIN_FREED = 32 * 1024
+# keys copied between two checks of the compaction time budget
+_COMPACT_CHECK = 16
+# records purged between two checks of the retention time budget
+_PURGE_BATCH = 16
+# number of legacy keys rewritten per pass of the migration
+_MIGRATION_BATCH = 32
+
+# (database file, namespace) -> {index name: key function},
+# see declare_index(); files are keyed by absolute path
+_declared_indexes = {}
+
+
+def _record_key(seq):
+    """ Returns the fixed width key for a sequence number.
+
+    Parameters:
+        seq (int): record sequence number
+
+    Returns:
+        (bytes) zero-padded record key
+    """
+    return b'%010d' % seq
+
+
+def _migrate_keys(db):
+    """ Rewrites the unpadded keys of a legacy database
+        file as fixed width keys.
+
+    Legacy keys never start with "0", while padded keys do,
+    so rewritten records move out of the scanned range and
+    the scan can resume after the last key it saw. Only a
+    small batch of keys is held in memory at a time.
+
+    Parameters:
+        db (btree): open database
+    """
+    start = b'1'
+    while True:
+        batch = []
+        for key in db.keys(start, _RECORD_END):
+            if len(key) < _KEY_WIDTH:
+                batch.append(key)
+                if len(batch) >= _MIGRATION_BATCH:
+                    break
+        if not batch:
+            return
+        for key in batch:
+            db[_record_key(int(key))] = db[key]
+            del db[key]
+        start = batch[-1]
+
+
+def _upgrade(db):
+    """ Brings an open database to the current key format.
+
+    Parameters:
+        db (btree): open database
+    """
+    if db.get(_VERSION_KEY) == _FORMAT_VERSION:
+        return
+    _migrate_keys(db)
+    db[_VERSION_KEY] = _FORMAT_VERSION
+
+
+def _file_key(path):
+    """ Returns the absolute, normalised form of a file path, so
+        different spellings of one file find the same indexes.
+    """
+    if not path.startswith('/'):
+        path = os.getcwd().rstrip('/') + '/' + path
+    parts = []
+    for part in path.split('/'):
+        if part in ('', '.'):
+            continue
+        if part == '..':
+            if parts:
+                parts.pop()
+            continue
+        parts.append(part)
+    return '/' + '/'.join(parts)
+
+
+def _check_name(name, kind):
+    """ Raises ValueError for names that would break the key layout.
+    """
+    if not name or name[0] in '0123456789' or '/' in name or '\x00' in name \
+            or max(name) >= '\x7f':
+        raise ValueError('invalid %s name %r' % (kind, name))
+
+
+class DatabaseFull(OSError):
+    """ Raised when an append would go over the capacity
+        and no record may be evicted to make room.
+    """
+
+
+def declare_index(database_file, name, key_func, namespace=None):
+    """ Declares a secondary index over the records of a database.
+
+    Usage:
+        declare_index('outbox.db', 'card',
+                      lambda value: codec.decode(value)[2])
+
+    The index applies from the next change on, also to a
+    database that is already open; existing records are only
+    indexed by reindex().
+
+    Parameters:
+        database_file {str}: selected database file
+        name (str): index name
+        key_func (function): returns the indexed value (bytes
+                             or str) of a record value, or None
+                             to leave the record out of the index
+        namespace (str): namespace of the records (default: none)
+    """
+    _check_name(name, 'index')
+    _declared_indexes.setdefault((_file_key(database_file), namespace), {})[name] = key_func
+
+
+class Namespace:
+    """ A queue of records sharing a key prefix in a Database.
+
+    Namespaces are obtained with Database.namespace(); all
+    their changes go through the database transactions.
+
+    Parameters:
+        database (Database): database holding the namespace
+        name (str): namespace name (None for the default namespace)
+    """
+
+    def __init__(self, database, name=None):
+        if name is None:
+            prefix = b''
+        else:
+            _check_name(name, 'namespace')
+            prefix = name.encode() + _NAMESPACE_SEP
+        self.database = database
+        self.name = name
+        self._prefix = prefix
+        self._start = prefix + _RECORD_START
+        self._end = prefix + _RECORD_END
+        self._seq_key = _META_PREFIX + prefix + _SEQ_NAME
+        self._count_key = _META_PREFIX + prefix + _COUNT_NAME
+        self._bytes_key = _META_PREFIX + prefix + _BYTES_NAME
+        self._compress_key = _META_PREFIX + prefix + _COMPRESS_NAME
+        self._mark_start = _TIME_PREFIX + prefix + _RECORD_START
+        self._mark_end = _TIME_PREFIX + prefix + _RECORD_END
+        # registry key of the indexes of the namespace
+        self._index_registry = (_file_key(database.database_file), name)
+        self._load()
+
+    @property
+    def _indexes(self):
+        """ Index name -> key function, looked up on each use so
+            indexes declared after the file was opened apply.
+        """
+        return _declared_indexes.get(self._index_registry, {})
+
+    def declare_index(self, name, key_func):
+        """ Declares a secondary index over the records of the
+            namespace (see the declare_index() function).
+
+        Parameters:
+            name (str): index name
+            key_func (function): returns the indexed value of a
+                                 record value, or None
+        """
+        declare_index(self.database.database_file, name, key_func, self.name)
+
+    def _load(self):
+        """ Reads the counters of the namespace.
+
+        Files written before the counters existed do not have
+        their metadata records, so they are rebuilt (the
+        sequence number from the last key, the count and size
+        by walking the records) and saved on the next flush.
+        """
+        db = self.database._db
+        # counters changed since they were last written
+        self._stale = False
+        try:
+            self._seq = int(db[self._seq_key])
+        except KeyError:
+            # since keys are fixed width, the last key
+            # holds the highest sequence number
+            key = self._last_key()
+            self._seq = 0 if key is None else int(key[-_KEY_WIDTH:])
+            self._stale = True
+        try:
+            self._count = int(db[self._count_key])
+            self._bytes = int(db[self._bytes_key])
+        except KeyError:
+            self._count, self._bytes = self._measure()
+            self._stale = True
+        if self._stale:
+            self.database._dirty = True
+        # key of the first record stored with a compression tag
+        # (None if compression was never turned on) and the
+        # compression threshold (0 when turned off)
+        self._tagged = None
+        self._threshold = 0
+        value = db.get(self._compress_key)
+        if value is not None:
+            seq, threshold = value.split()
+            self._tagged = self._key(int(seq))
+            self._threshold = int(threshold)
+        # start of the time bucket of the last marker
+        self._bucket = 0
+        for key in db.keys(self._mark_end, self._mark_start, btree.DESC):
+            if key < self._mark_end:
+                self._bucket = int(key[-_KEY_WIDTH:])
+                break
+
+    def _save(self):
+        """ Writes the counters if they changed.
+        """
+        if not self._stale:
+            return
+        database = self.database
+        database._set(self._seq_key, str(self._seq))
+        database._set(self._count_key, str(self._count))
+        database._set(self._bytes_key, str(self._bytes))
+        self._stale = False
+
+    def set_compression(self, enabled=True, threshold=compression.THRESHOLD):
+        """ Turns compression of the values put from now on
+            on or off (records already stored are kept as they
+            are and stay readable).
+
+        Parameters:
+            enabled (bool): compress new values
+            threshold (int): values shorter than this are
+                             stored uncompressed (bytes)
+        """
+        if self._tagged is None:
+            self._tagged = self._key(self._seq + 1)
+        self._threshold = threshold if enabled else 0
+        self.database._set(self._compress_key, b'%d %d' % (
+            int(self._tagged[-_KEY_WIDTH:]), self._threshold))
+        self._changed()
+
+    def _value(self, key, value):
+        """ Returns the value of a record as it was put
+            (decompressed if it carries a compression tag).
+        """
+        if self._tagged is not None and key >= self._tagged:
+            return compression.decompress(value)
+        return value
+
+    def _changed(self):
+        """ Records a change, flushing it unless a transaction is open.
+        """
+        self._stale = True
+        self.database._flush_if_idle()
+
+    def _mark_key(self, timestamp):
+        """ Returns the time marker key for a time (s).
+        """
+        return _TIME_PREFIX + self._prefix + b'%010d' % timestamp
+
+    def _mark(self):
+        """ Writes a time marker for the next record if it is
+            the first one of a time bucket.
+        """
+        bucket = int(time.time()) // _TIME_BUCKET * _TIME_BUCKET
+        # the clock may go back until it is set
+        if bucket > self._bucket:
+            self.database._set(self._mark_key(bucket), str(self._seq + 1))
+            self._bucket = bucket
+
+    def _purge_end(self, cutoff):
+        """ Returns the key after the last record of the time
+            buckets ending at or before cutoff, and the key of
+            the first time marker to keep.
+        """
+        db = self.database._db
+        # first bucket that may hold records newer than cutoff
+        start = self._mark_key(max(cutoff - _TIME_BUCKET + 1, 0))
+        for key, value in db.items(start, self._mark_end):
+            return self._key(int(value)), key
+        return self._end, self._mark_end
+
+    def _key(self, seq):
+        """ Returns the record key for a sequence number.
+        """
+        return self._prefix + _record_key(seq)
+
+    def _keys(self):
+        """ Returns an iterator over the record keys, skipping
+            the metadata records and other namespaces.
+        """
+        return self.database._db.keys(self._start, self._end)
+
+    def _last_key(self):
+        """ Returns the highest record key (None if there are no records).
+        """
+        # a descending scan starts at the first key >= self._end,
+        # which belongs to something else when there is one, so
+        # skip past it
+        for key in self.database._db.keys(self._end, self._start, btree.DESC):
+            if key < self._end:
+                return key
+        return None
+
+    def _measure(self):
+        """ Counts the records and their bytes by walking every
+            record (slow path used to rebuild the counters).
+
+        Returns:
+            (tuple) number of records and their size in bytes
+        """
+        _count = 0
+        _bytes = 0
+        for key, value in self.database._db.items(self._start, self._end):
+            _count += 1
+            _bytes += len(key) + len(value)
+        return _count, _bytes
+
+    def count(self):
+        """ Returns the number of records.
+
+        Returns:
+            (int) total count
+        """
+        return self._count
+
+    def size(self):
+        """ Returns the number of bytes (keys and values) of the records.
+
+        Returns:
+            (int) total size
+        """
+        return self._bytes
+
+    def verify_count(self):
+        """ Recounts the records by walking the whole namespace
+            and repairs the stored count and size (e.g. after a
+            crash).
+
+        Returns:
+            (int) total count
+        """
+        self._count, self._bytes = self._measure()
+        self._changed()
+        return self._count
+
+    def get(self):
+        """ Returns and removes the oldest record.
+
+        Returns:
+            value (bytes): the record (b'' if there are no records)
+        """
+        values = self.get_many(1)
+        if values:
+            return values[0]
+        return b''
+
+    def get_many(self, count):
+        """ Returns and removes up to count of the oldest records.
+
+        Parameters:
+            count (int): maximum number of records to return
+
+        Returns:
+            values (list): the records in key order (empty if none)
+        """
+        records = self.peek(count)
+        self.remove([key for key, _ in records])
+        return [value for _, value in records]
+
+    def peek(self, count, exclude=()):
+        """ Returns up to count of the oldest records
+            without removing them.
+
+        Parameters:
+            count (int): maximum number of records to return
+            exclude (set): record keys to skip
+
+        Returns:
+            records (list): (key, value) tuples in key order
+        """
+        records = []
+        if count <= 0:
+            return records
+        # the ordered iteration stops after count keys,
+        # so the remaining keys are never loaded
+        for key, value in self.database._db.items(self._start, self._end):
+            if key in exclude:
+                continue
+            records.append((key, self._value(key, value)))
+            if len(records) >= count:
+                break
+        return records
+
+    def scan(self, start=None, end=None, limit=None):
+        """ Returns the records with sequence numbers in [start, end).
+
+        Parameters:
+            start (int): first sequence number (default: oldest record)
+            end (int): sequence number after the last (default: newest record)
+            limit (int): maximum number of records (default: all)
+
+        Returns:
+            records (list): (key, value) tuples in key order
+        """
+        start_key = self._start if start is None else self._key(start)
+        end_key = self._end if end is None else self._key(end)
+        records = []
+        if limit == 0:
+            return records
+        for key, value in self.database._db.items(start_key, end_key):
+            records.append((key, self._value(key, value)))
+            if len(records) == limit:
+                break
+        return records
+
+    def iter_records(self, start_key=None, end_key=None, batch=32):
+        """ Yields the records with keys in [start_key, end_key)
+            without building a list of all of them (e.g. to
+            export a day of records over GPRS or BLE).
+
+        Records are read batch at a time and the cursor is
+        reopened after the last key of each batch, so records
+        may be put or removed between two steps of the loop,
+        and at most batch records are held in RAM.
+
+        Usage:
+            for key, value in db.iter_records():
+                uart.write(value)
+
+        Parameters:
+            start_key (bytes): first key (default: oldest record)
+            end_key (bytes): key after the last (default: past
+                             the newest record)
+            batch (int): records read per cursor
+
+        Yields:
+            (tuple) key and value as a memoryview
+        """
+        cursor = self._start if start_key is None else start_key
+        end_key = self._end if end_key is None else end_key
+        records = []
+        while True:
+            for record in self.database._db.items(cursor, end_key):
+                records.append(record)
+                if len(records) == batch:
+                    break
+            for key, value in records:
+                yield key, memoryview(self._value(key, value))
+            if len(records) < batch:
+                return
+            # the smallest key after the last one read
+            cursor = records[-1][0] + b'\x00'
+            records.clear()
+
+    def remove(self, keys):
+        """ Removes the records under the given keys,
+            ignoring keys that are no longer stored.
+
+        Parameters:
+            keys (list): record keys as returned by peek()
+
+        Returns:
+            (int) number of records removed
+        """
+        database = self.database
+        removed = 0
+        for key in keys:
+            value = database._db.get(key)
+            if value is None:
+                continue
+            for index_key in self._index_keys(key, value, True):
+                # records stored before the index was declared
+                # have no entry until reindex()
+                try:
+                    database._delete(index_key)
+                except KeyError:
+                    pass
+            database._delete(key)
+            removed += 1
+            self._bytes -= len(key) + len(value)
+            database._freed += len(key) + len(value)
+        if removed:
+            self._count -= removed
+            self._changed()
+        return removed
+
+    def put(self, data):
+        """ Appends records.
+
+        Raises DatabaseFull (and stores nothing) if the records
+        do not fit in the capacity of the database.
+
+        Parameters:
+            data (tuple): tuple of values
+        """
+        database = self.database
+        stored = data
+        if self._tagged is not None:
+            stored = [compression.compress(value, self._threshold)
+                      for value in data]
+        size = len(data) * (len(self._prefix) + _KEY_WIDTH)
+        for value in stored:
+            size += len(value)
+        # evictions and the new records share one flush
+        database.begin()
+        try:
+            database._reserve(len(data), size)
+            self._mark()
+            for value, stored_value in zip(data, stored):
+                self._seq += 1
+                self._count += 1
+                key = self._key(self._seq)
+                database._set(key, stored_value)
+                for index_key in self._index_keys(key, value):
+                    database._set(index_key, b'')
+            self._bytes += size
+            self._changed()
+        finally:
+            database.commit()
+
+    def truncate(self):
+        """ Erase all records of the namespace and their index entries.
+        """
+        database = self.database
+        for key in self._keys():
+            database._delete(key)
+        for key in database._db.keys(self._mark_start, self._mark_end):
+            database._delete(key)
+        self._bucket = 0
+        self._drop_index()
+        database._freed += self._bytes
+        self._count = 0
+        self._bytes = 0
+        self._changed()
+
+    def _index_prefix(self, name, value=b''):
+        """ Returns the key prefix of the index entries for a value
+            (or of the whole index when no value is given).
+        """
+        if isinstance(value, str):
+            value = value.encode()
+        return _INDEX_PREFIX + self._prefix + name.encode() + b'\x00' + value
+
+    def _index_end(self, name):
+        """ Returns the key after the last entry of an index.
+        """
+        return _INDEX_PREFIX + self._prefix + name.encode() + b'\x01'
+
+    def _index_keys(self, key, value, stored=False):
+        """ Returns the index entry keys of a record (whose value
+            is as stored if stored is True).
+        """
+        index_keys = []
+        if stored and self._indexes:
+            value = self._value(key, value)
+        for name, key_func in self._indexes.items():
+            index_value = key_func(value)
+            if index_value is not None:
+                index_keys.append(self._index_prefix(name, index_value)
+                                  + b'\x00' + key[-_KEY_WIDTH:])
+        return index_keys
+
+    def _index_scan(self, prefix, start, end, flags=0, exact=False):
+        """ Yields the (key, value) records of the index entries
+            between start and end.
+        """
+        db = self.database._db
+        for index_key in db.keys(start, end, flags):
+            # a descending scan may start above its range
+            if flags & btree.DESC and index_key >= start:
+                continue
+            # with an exact value, skip longer values sharing its prefix
+            if exact and len(index_key) != len(prefix) + 1 + _KEY_WIDTH:
+                continue
+            key = self._prefix + index_key[-_KEY_WIDTH:]
+            yield key, self._value(key, db[key])
+
+    def find(self, name, value, limit=None):
+        """ Returns the records whose index value equals value.
+
+        Parameters:
+            name (str): index name
+            value (bytes|str): indexed value
+            limit (int): maximum number of records (default: all)
+
+        Returns:
+            records (list): (key, value) tuples in key order
+        """
+        prefix = self._index_prefix(name, value)
+        records = []
+        if limit == 0:
+            return records
+        for record in self._index_scan(prefix, prefix + b'\x00', prefix + b'\x01', exact=True):
+            records.append(record)
+            if len(records) == limit:
+                break
+        return records
+
+    def find_last(self, name, value):
+        """ Returns the newest record whose index value equals value.
+
+        Parameters:
+            name (str): index name
+            value (bytes|str): indexed value
+
+        Returns:
+            record (tuple): (key, value), None if there is none
+        """
+        prefix = self._index_prefix(name, value)
+        for record in self._index_scan(prefix, prefix + b'\x01', prefix + b'\x00',
+                                       btree.DESC, exact=True):
+            return record
+        return None
+
+    def find_range(self, name, start=None, end=None, limit=None):
+        """ Returns the records whose index value lies in [start, end).
+
+        Parameters:
+            name (str): index name
+            start (bytes|str): lowest value (default: no lower bound)
+            end (bytes|str): value after the highest (default: no upper bound)
+            limit (int): maximum number of records (default: all)
+
+        Returns:
+            records (list): (key, value) tuples in index value order
+        """
+        prefix = self._index_prefix(name)
+        start_key = prefix if start is None else self._index_prefix(name, start)
+        end_key = self._index_end(name) if end is None else self._index_prefix(name, end)
+        records = []
+        if limit == 0:
+            return records
+        for record in self._index_scan(prefix, start_key, end_key):
+            records.append(record)
+            if len(records) == limit:
+                break
+        return records
+
+    def reindex(self, name):
+        """ Rebuilds an index over every record (slow path, e.g.
+            after declaring an index on an existing database).
+
+        Parameters:
+            name (str): index name
+        """
+        database = self.database
+        self._drop_index(name)
+        key_func = self._indexes[name]
+        for key, value in database._db.items(self._start, self._end):
+            index_value = key_func(self._value(key, value))
+            if index_value is not None:
+                database._set(self._index_prefix(name, index_value)
+                              + b'\x00' + key[-_KEY_WIDTH:], b'')
+        self._changed()
+
+    def _drop_index(self, name=None):
+        """ Removes the entries of an index (of every declared
+            index if no name is given).
+        """
+        database = self.database
+        for index_name in self._indexes if name is None else (name,):
+            for index_key in database._db.keys(self._index_prefix(index_name),
+                                               self._index_end(index_name)):
+                database._delete(index_key)
+
+
+class Database(Namespace):
+    """ A btree database kept open on a file.
+
+    The Database is the default namespace of the file; other
+    namespaces are returned by namespace().
+
+    Usage:
+        db = Database('store.db')
+        outbox = db.namespace('outbox')
+        db.begin()
+        value = outbox.get()
+        db.namespace('receipts').put((value,))
+        db.commit()  # single flush for both changes
+        db.close()
+
+    Parameters:
+        database_file {str}: selected database file
+        create (bool): create the file if it does not exist,
+                       otherwise OSError is raised
+    """
+
+    def __init__(self, database_file, create=True):
+        self.database_file = database_file
+        # if the database file does not exist
+        # a database needs to be created.
+        created = False
+        try:
+            self._file = open(database_file, "r+b")
+        except OSError:
+            if not create:
+                raise
+            self._file = open(database_file, "w+b")
+            created = True
+        self._db = btree.open(self._file, minkeypage = 100)
+        self._journal = journal.Journal(database_file + _JOURNAL_SUFFIX)
+        self._txid, offset = (int(field) for field in
+                              self._db.get(_TXID_KEY, b'0 0').split())
+        if created or not self._txid:
+            # left over from a deleted file (or the file was
+            # written without a journal)
+            self._journal.reset()
+        else:
+            self._recover(offset)
+        # nesting depth of begin() calls
+        self._depth = 0
+        # changes since the last flush
+        self._dirty = False
+        # namespace name -> Namespace
+        self._namespaces = {None: self}
+        # compaction in progress: new file, its btree and the
+        # last key copied into it
+        self._compact_file = None
+        self._compact_db = None
+        self._copied = None
+        _upgrade(self._db)
+        Namespace.__init__(self, self)
+        self._load_database()
+        self._flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _recover(self, offset):
+        """ Replays the transactions that were committed to the
+            journal but whose btree flush did not complete, and
+            drops any uncommitted tail.
+
+        Parameters:
+            offset (int): journal size after the last commit
+                          flushed to the btree
+        """
+        transactions = self._journal.recover(self._txid, offset)
+        if not transactions and self._journal.committed == self._journal.size():
+            return
+        db = self._db
+        for txid, changes in transactions:
+            for op, key, value in changes:
+                if op == journal.SET:
+                    db[key] = value
+                else:
+                    try:
+                        del db[key]
+                    except KeyError:
+                        pass
+            self._txid = txid
+        self._journal.reset()
+        db[_TXID_KEY] = b'%d 0' % self._txid
+        db.flush()
+
+    def _load_database(self):
+        """ Reads the file wide settings and loads every
+            namespace stored in the file.
+        """
+        db = self._db
+        self._freed = int(db.get(_FREED_KEY, b'0'))
+        self._capacity = None
+        value = db.get(_CAPACITY_KEY)
+        if value is not None:
+            fields = value.decode().split()
+            self._capacity = (int(fields[0]) or None, int(fields[1]) or None,
+                              tuple(None if name == _DEFAULT_NAME else name
+                                    for name in fields[2:]))
+        names = []
+        suffix = _NAMESPACE_SEP + _SEQ_NAME
+        for key in db.keys(_META_PREFIX):
+            if key.endswith(suffix):
+                names.append(key[len(_META_PREFIX):-len(suffix)].decode())
+        for name in names:
+            self.namespace(name)
+
+    def namespace(self, name):
+        """ Returns a namespace of the database, sharing its
+            file, cache and transactions.
+
+        Parameters:
+            name (str): namespace name (letters first, no "/")
+
+        Returns:
+            (Namespace) the namespace
+        """
+        try:
+            return self._namespaces[name]
+        except KeyError:
+            pass
+        namespace = Namespace(self, name)
+        self._namespaces[name] = namespace
+        return namespace
+
+    def begin(self):
+        """ Starts a transaction: changes are kept in the
+            btree cache until the matching commit().
+            Transactions may be nested, only the outermost
+            commit() flushes.
+        """
+        self._depth += 1
+
+    def commit(self):
+        """ Ends a transaction, flushing the changes
+            to the file if it is the outermost one.
+        """
+        if self._depth == 0:
+            raise ValueError('commit() without begin()')
+        self._depth -= 1
+        if self._depth == 0:
+            self._flush()
+
+    def close(self):
+        """ Flushes any pending changes and closes the database
+            (dropping a compaction in progress).
+        """
+        self._depth = 0
+        self._flush()
+        self._abort_compaction()
+        self._db.close()
+        self._file.close()
+        self._journal.close()
+
+    def _set(self, key, value, log=True):
+        """ Stores a key (journaled first unless log is False),
+            also in the compacted file once the compaction has
+            copied past it.
+        """
+        if log:
+            self._journal.set(key, value)
+        self._db[key] = value
+        if self._copied is not None and key <= self._copied:
+            self._compact_db[key] = value
+
+    def _delete(self, key):
+        """ Deletes a key (KeyError if missing, journaled first),
+            also from the compacted file once the compaction has
+            copied past it.
+        """
+        self._journal.delete(key)
+        del self._db[key]
+        if self._copied is not None and key <= self._copied:
+            try:
+                del self._compact_db[key]
+            except KeyError:
+                pass
+
+    def _flush_if_idle(self):
+        """ Flushes a change unless a transaction is open.
+        """
+        self._dirty = True
+        if self._depth == 0:
+            self._flush()
+
+    def _flush(self):
+        """ Writes the counters, commits the journal and flushes
+            the btree.
+        """
+        if not self._dirty:
+            return
+        # counters are saved in the same flush as the records
+        for namespace in self._namespaces.values():
+            namespace._save()
+        self._set(_FREED_KEY, str(self._freed))
+        self._txid += 1
+        self._journal.commit(self._txid)
+        # only read on open, where recovery sets it itself
+        self._set(_TXID_KEY, b'%d %d' % (self._txid, self._journal.size()), False)
+        self._db.flush()
+        self._dirty = False
+        # the btree now holds everything in the journal; a
+        # second flush points recovery at its new start
+        if self._journal.size() > journal.LIMIT:
+            self._journal.reset()
+            self._set(_TXID_KEY, b'%d 0' % self._txid, False)
+            self._db.flush()
+
+    def _replace(self, new_file):
+        """ Closes the database, renames new_file over it and
+            opens the result.
+        """
+        self._db.close()
+        self._file.close()
+        os.rename(new_file, self.database_file)
+        self._file = open(self.database_file, "r+b")
+        self._db = btree.open(self._file, minkeypage = 100)
+
+    def truncate(self):
+        """ Erase all records of every namespace by replacing the
+            file with a fresh empty btree (written first, then
+            renamed over the old one, so a power loss leaves one
+            or the other). Use clear() to only erase the default
+            namespace.
+
+        Pending changes of an open transaction are discarded,
+        but the sequence numbers carry on, so keys are never
+        reused. The capacity policy and compression settings
+        are kept.
+        """
+        self._abort_compaction()
+        temp_file = self.database_file + _TEMP_SUFFIX
+        with open(temp_file, "w+b") as file:
+            db = btree.open(file, minkeypage = 100)
+            db[_VERSION_KEY] = _FORMAT_VERSION
+            db[_TXID_KEY] = b'%d 0' % self._txid
+            capacity = self._db.get(_CAPACITY_KEY)
+            if capacity is not None:
+                db[_CAPACITY_KEY] = capacity
+            for namespace in self._namespaces.values():
+                if namespace._tagged is not None:
+                    db[namespace._compress_key] = self._db[namespace._compress_key]
+                db[namespace._seq_key] = str(namespace._seq)
+                db[namespace._count_key] = b'0'
+                db[namespace._bytes_key] = b'0'
+            db.close()
+        self._replace(temp_file)
+        # drops the changes of an open transaction
+        self._journal.reset()
+        for namespace in self._namespaces.values():
+            namespace._count = 0
+            namespace._bytes = 0
+            namespace._bucket = 0
+            namespace._stale = False
+        self._freed = 0
+        self._dirty = False
+
+    def set_capacity(self, max_records=None, max_bytes=None, evict=()):
+        """ Stores a capacity policy in the file, applied by every
+            later append (through any Database or module function).
+
+        Usage:
+            # up to 5000 records; drop uploaded receipts first,
+            # then the oldest log lines, never outbox records
+            db.set_capacity(max_records=5000, evict=('receipts', 'logs'))
+
+        Parameters:
+            max_records (int): maximum number of records over all
+                               namespaces (None for no limit)
+            max_bytes (int): maximum bytes of keys and values over
+                             all namespaces (None for no limit)
+            evict (tuple): namespaces (None for the default one)
+                           whose oldest records may be evicted to
+                           make room, in the order they are tried
+        """
+        if max_records is None and max_bytes is None:
+            self._capacity = None
+            try:
+                self._delete(_CAPACITY_KEY)
+            except KeyError:
+                pass
+        else:
+            for name in evict:
+                if name is not None:
+                    _check_name(name, 'namespace')
+            self._capacity = (max_records, max_bytes, tuple(evict))
+            names = [_DEFAULT_NAME if name is None else name for name in evict]
+            self._set(_CAPACITY_KEY, ' '.join([str(max_records or 0),
+                                               str(max_bytes or 0)] + names))
+        self._flush_if_idle()
+
+    def _reserve(self, records, size):
+        """ Makes room for new records by evicting the oldest
+            records allowed by the capacity policy.
+
+        Parameters:
+            records (int): number of records to be added
+            size (int): their bytes (keys and values)
+        """
+        if self._capacity is None:
+            return
+        max_records, max_bytes, evict = self._capacity
+        total_records = 0
+        total_bytes = 0
+        for namespace in self._namespaces.values():
+            total_records += namespace._count
+            total_bytes += namespace._bytes
+        excess_records = total_records + records - max_records if max_records else 0
+        excess_bytes = total_bytes + size - max_bytes if max_bytes else 0
+        if excess_records <= 0 and excess_bytes <= 0:
+            return
+        # fail before evicting anything if eviction cannot make room
+        victims = [self.namespace(name) for name in evict]
+        evictable_records = 0
+        evictable_bytes = 0
+        for namespace in victims:
+            evictable_records += namespace._count
+            evictable_bytes += namespace._bytes
+        if excess_records > evictable_records or excess_bytes > evictable_bytes:
+            raise DatabaseFull('database full')
+        for namespace in victims:
+            while (excess_records > 0 or excess_bytes > 0) and namespace._count:
+                # the stored (compressed) size is what remove() frees
+                for key, value in self._db.items(namespace._start, namespace._end):
+                    break
+                namespace.remove((key,))
+                excess_records -= 1
+                excess_bytes -= len(key) + len(value)
+
+    def compact_step(self, budget_ms=20):
+        """ Runs one slice of the incremental compaction, for
+            the idle loop. A compaction starts once more bytes
+            were removed than are still stored; each slice
+            copies keys into a new file for about budget_ms,
+            and the last one renames the new file over the old.
+
+        Changes made between slices go to both files, so
+        compaction never holds up an append. Nothing happens
+        while a transaction is open.
+
+        Parameters:
+            budget_ms (int): time budget of the slice
+
+        Returns:
+            (bool) True when no compaction is in progress
+        """
+        if self._depth:
+            return self._compact_db is None
+        if self._compact_db is None:
+            stored = 0
+            for namespace in self._namespaces.values():
+                stored += namespace._bytes
+            if self._freed < max(stored, _COMPACT_MIN_FREED):
+                return True
+            self._compact_file = open(self.database_file + _COMPACT_SUFFIX, "w+b")
+            self._compact_db = btree.open(self._compact_file, minkeypage = 100)
+        start = ticks_ms()
+        copied = 0
+        next_key = None if self._copied is None else self._copied + b'\x00'
+        for key, value in self._db.items(next_key):
+            self._compact_db[key] = value
+            self._copied = key
+            copied += 1
+            if copied % _COMPACT_CHECK == 0 and ticks_diff(ticks_ms(), start) >= budget_ms:
+                self._compact_db.flush()
+                return False
+        # every key is copied: save the counters (to both files)
+        # and switch to the new file
+        self._freed = 0
+        self._dirty = True
+        self._flush()
+        self._compact_db.close()
+        self._compact_file.close()
+        self._compact_file = None
+        self._compact_db = None
+        self._copied = None
+        self._replace(self.database_file + _COMPACT_SUFFIX)
+        return True
+
+    def _abort_compaction(self):
+        """ Drops a compaction in progress.
+        """
+        if self._compact_db is None:
+            return
+        self._compact_db.close()
+        self._compact_file.close()
+        os.remove(self.database_file + _COMPACT_SUFFIX)
+        self._compact_file = None
+        self._compact_db = None
+        self._copied = None
+
+    def clear(self):
+        """ Erase all records of the default namespace one key
+            at a time (see truncate() for the fast path).
+        """
+        Namespace.truncate(self)
+
+
+class Retention:
+    """ Purges the records of a namespace that are older than
+        a maximum age, a slice at a time during idle periods.
+
+    The records to purge are found from the time markers, as
+    the key range before the first bucket that may hold newer
+    records, so records are kept up to _TIME_BUCKET longer than
+    max_age. With an archive file, each slice is appended to it
+    as one compressed block (see read_archive) before it is
+    deleted; a power loss in between archives the slice again.
+
+    Usage:
+        retention = Retention(db.namespace('receipts'), 30 * 86400,
+                              'receipts.arc')
+        # idle loop
+        retention.step()
+
+    Parameters:
+        namespace (Namespace): namespace to purge
+        max_age (int): age of the records to purge (s)
+        archive_file (str): file purged records are appended
+                            to (None for no archive)
+    """
+
+    def __init__(self, namespace, max_age, archive_file=None):
+        self.namespace = namespace
+        self.max_age = max_age
+        self.archive_file = archive_file
+        # purge in progress: key after its last record and
+        # first time marker to keep
+        self._end = None
+        self._mark = None
+
+    def step(self, budget_ms=20, now=None):
+        """ Purges old records for about budget_ms.
+
+        Parameters:
+            budget_ms (int): time budget of the slice
+            now (int): current time (s, default: time.time())
+
+        Returns:
+            (bool) True when no old records are left
+        """
+        namespace = self.namespace
+        database = namespace.database
+        if self._end is None:
+            if now is None:
+                now = int(time.time())
+            self._end, self._mark = namespace._purge_end(now - self.max_age)
+        start = ticks_ms()
+        database.begin()
+        try:
+            while True:
+                keys = []
+                for key in database._db.keys(namespace._start, self._end):
+                    keys.append(key)
+                    if len(keys) == _PURGE_BATCH:
+                        break
+                if not keys:
+                    break
+                if self.archive_file is not None:
+                    self._archive(keys)
+                namespace.remove(keys)
+                if ticks_diff(ticks_ms(), start) >= budget_ms:
+                    return False
+            marks = list(database._db.keys(namespace._mark_start, self._mark))
+            for key in marks:
+                database._delete(key)
+            if marks:
+                database._dirty = True
+            self._end = None
+            return True
+        finally:
+            database.commit()
+
+    def _archive(self, keys):
+        """ Appends the records under keys to the archive file
+            as one compressed block.
+        """
+        namespace = self.namespace
+        db = namespace.database._db
+        payload = bytearray()
+        for key in keys:
+            value = namespace._value(key, db[key])
+            payload.extend(struct.pack('<HI', len(key), len(value)))
+            payload.extend(key)
+            payload.extend(value)
+        block = compression.compress(bytes(payload), 1)
+        with open(self.archive_file, 'ab') as file:
+            file.write(struct.pack('<I', len(block)))
+            file.write(block)
+
+
+def read_archive(archive_file):
+    """ Yields the records appended to an archive file by
+        Retention, block by block.
+
+    Parameters:
+        archive_file (str): archive file
+
+    Yields:
+        (tuple) key and value
+    """
+    with open(archive_file, 'rb') as file:
+        while True:
+            header = file.read(4)
+            if len(header) < 4:
+                return
+            block = file.read(struct.unpack('<I', header)[0])
+            payload = compression.decompress(block)
+            pos = 0
+            while pos < len(payload):
+                key_size, value_size = struct.unpack_from('<HI', payload, pos)
+                pos += 6
+                key = payload[pos:pos + key_size]
+                pos += key_size
+                yield key, payload[pos:pos + value_size]
+                pos += value_size
 
 
 def get_inventory(database_file):
-    """ Returns total .
+    """ Returns total number of records, read from
+        the count kept alongside the records.
 
     Parameters:
         database_file {str}: selected database file
@@ -26,13 +1354,22 @@ def get_inventory(database_file):
     Returns:
         (int) total count
     """
-    with open(database_file, "r+b") as file:
-        db = btree.open(file, minkeypage = 100)
-        value_list = list(db.keys())
-        _count = len(value_list)
-        db.flush()
-        db.close()
-    return _count
+    with Database(database_file, create=False) as db:
+        return db.count()
+
+
+def verify_inventory(database_file):
+    """ Recounts the records by walking the whole database
+        and repairs the stored count (e.g. after a crash).
+
+    Parameters:
+        database_file {str}: selected database file
+
+    Returns:
+        (int) total count
+    """
+    with Database(database_file, create=False) as db:
+        return db.verify_count()
 
 
 def get_value(database_file):
@@ -45,25 +1382,43 @@ def get_value(database_file):
     Returns:
         value (bytes): the value under the key
     """
-    # if the database file does not exist
-    # a database needs to be created.
-    try:
-        file = open(database_file, "r+b")
-    except OSError:
-        file = open(database_file, "w+b")
-    db = btree.open(file, minkeypage = 100)
-    _list = list(db.keys())
-    # if database is not empty get value
-    if _list != []:
-        _key = _list.pop(0)
-        value = db.get(_key)
-        del db[_key]
-    else:
-        value = b''
-    db.flush()
-    db.close()
-    file.close()
-    return value
+    with Database(database_file) as db:
+        return db.get()
+
+
+def get_values(count, database_file):
+    """ Returns (and removes) up to count values from the
+        front of the given database in one open/flush cycle.
+
+    Parameters:
+        count (int): maximum number of values to return
+        database_file {str}: selected database file
+
+    Returns:
+        values (list): the values in key order (empty if none)
+    """
+    with Database(database_file) as db:
+        return db.get_many(count)
+
+
+def iter_records(database_file, start_key=None, end_key=None, batch=32):
+    """ Yields the records of the given database with keys in
+        [start_key, end_key), batch at a time (see
+        Database.iter_records). The file stays open until the
+        generator is exhausted or closed.
+
+    Parameters:
+        database_file {str}: selected database file
+        start_key (bytes): first key (default: oldest record)
+        end_key (bytes): key after the last (default: past the newest record)
+        batch (int): records read per cursor
+
+    Yields:
+        (tuple) key and value as a memoryview
+    """
+    with Database(database_file, create=False) as db:
+        for record in db.iter_records(start_key, end_key, batch):
+            yield record
 
 
 def update_database(data, database_file):
@@ -76,20 +1431,11 @@ def update_database(data, database_file):
     Returns:
         status (bool): True for success False for failure.
     """
-    with open(database_file, "r+b") as file:
-        db = btree.open(file, minkeypage = 100)
-        # if database is empty start database key at 0 else
-        # continue by incrementing from previous key
+    with Database(database_file, create=False) as db:
         try:
-            _key = max([int(x) for x in db.keys()])
-        except ValueError:
-            _key = 0
-        # add each value to the database
-        for value in data:
-            _key += 1
-            db[str(_key)] = value
-        db.flush()
-        db.close()
+            db.put(data)
+        except DatabaseFull:
+            return False
     return True
 
 
@@ -102,13 +1448,9 @@ def clean_database(database_file):
     Returns: None
     """
     try:
-        file = open(database_file, "r+b")
+        db = Database(database_file, create=False)
     except OSError:
         print(f'{database_file} Does not exist!')
         return
-    db = btree.open(file, minkeypage = 100)
-    for key in db:
-        del db[key]
-    db.flush()
+    db.truncate()
     db.close()
-    file.close()
@@ -6,81 +6,483 @@ import time
 import struct
 import binascii
 import re
+from http_parser import HttpParser
+from ring_buffer import RingBuffer
 from machine import Pin
-from machine import UART
+from modem import Modem, FINAL_RESULTS
 from sim808 import *
 import pttconfigure
 
+# HttpSession setting not sent to the module yet
+_UNSET = object()
+# request accepted by the module, but its result did not arrive
+_NO_RESULT = object()
+# time to wait for the +HTTPACTION result of a request (sec)
+HTTP_TIMEOUT = 30
+# bytes of response body read per AT+HTTPREAD
+HTTP_CHUNK = 512
+# receive buffer of send_simcom_http_query (bytes)
+RX_SIZE = 512
+# wait for data counted as one empty read (ms)
+_IDLE_MS = 100
+
+
+class TransferStats:
+    """ Throughput counters of the last send_simcom_http_query().
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Sets every counter back to zero.
+        """
+        # bytes received
+        self.bytes = 0
+        # time from the request to the end of the response (ms)
+        self.elapsed_ms = 0
+        # part of it spent waiting for data (ms)
+        self.idle_ms = 0
+
+    def rate(self):
+        """ Returns the receive throughput (0 before any transfer).
+
+        Returns:
+            (float) bytes per second
+        """
+        if not self.elapsed_ms:
+            return 0.0
+        return self.bytes * 1000 / self.elapsed_ms
+
+
+http_stats = TransferStats()
+_rx = RingBuffer(RX_SIZE)
+
+
+def read_reply(serialPort: Modem, timeout: float, terminators=FINAL_RESULTS) -> bytes:
+    """
+    Reads from the GSM/GPRS module until a line starting with one of
+    the terminators (or an error line, or a data prompt) arrives.
+
+    Parameters:
+    serialPort (Modem): The GSM/GPRS module.
+    timeout (float): Maximum time (sec) to wait for the end of the reply.
+    terminators (tuple): Lines (prefixes) ending the reply.
+
+    Returns:
+    (bytes): The reply read (up to the timeout if it did not end).
+    """
+    return serialPort.read_until(terminators, timeout)
+
+
+def _read_into(serialPort: Modem, buffer, count: int, timeout: float) -> int:
+    """
+    Reads count bytes from the GSM/GPRS module into a buffer.
+
+    Parameters:
+    serialPort (Modem): The GSM/GPRS module.
+    buffer (memoryview): Where to store the bytes.
+    count (int): Number of bytes to read.
+    timeout (float): Maximum time (sec) to wait for them.
+
+    Returns:
+    (int): Number of bytes read (less than count on timeout).
+    """
+    length = 0
+    start = time.ticks_ms()
+    while length < count:
+        got = serialPort.readinto(buffer[length:count])
+        if got:
+            length += got
+        else:
+            remaining = int(timeout * 1000) - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0:
+                break
+            serialPort.wait(remaining)
+    return length
+
 
-def send_at_command(serialPort: UART, commandString: str, waitTime: int) -> bytes:
+def read_http_chunk(serialPort: Modem, buffer, timeout: float) -> int:
     """
-    Sends AT commands to the GPRS module and returns the result.
+    Reads the reply to AT+HTTPREAD=<offset>,<len> into a buffer: the
+    +HTTPREAD: <count> line, count bytes of body and the final OK.
+    Unlike read_reply(), body bytes looking like result codes do not
+    end the read.
+
+    Parameters:
+    serialPort (Modem): The GSM/GPRS module.
+    buffer (memoryview): Where to store the body bytes (at least len).
+    timeout (float): Maximum time (sec) to wait for each part.
+
+    Returns:
+    (int): Number of body bytes stored (0 on error or timeout).
+    """
+    reply = read_reply(serialPort, timeout, (b'+HTTPREAD:',))
+    start = reply.find(b'+HTTPREAD:')
+    end = reply.find(b'\n', start)
+    if start < 0 or end < 0:
+        return 0
+    try:
+        count = min(int(reply[start + 10:end].strip()), len(buffer))
+    except ValueError:
+        return 0
+    # body bytes read along with the header line
+    extra = reply[end + 1:]
+    buffer[:min(len(extra), count)] = extra[:count]
+    if len(extra) < count:
+        count = len(extra) + _read_into(serialPort, buffer[len(extra):], count - len(extra), timeout)
+    if b'OK' not in extra[count:]:
+        read_reply(serialPort, timeout)
+    return count
+
+
+def send_at_command(serialPort: Modem, commandString: str, waitTime: int,
+                    terminators=FINAL_RESULTS) -> bytes:
+    """
+    Sends AT commands to the GPRS module and returns the result as
+    soon as its final result code (OK, ERROR, +CME ERROR, +CMS ERROR
+    or the > data prompt) arrives.
 
     Paramenters:
-    serialPort (uart): The UART interface to the GSM/GPRS module.
+    serialPort (Modem): The GSM/GPRS module.
     commandString (string): The AT command string.
-    waitTime (int): The time to wait between sending the AT command
-                    and reading the reply.
+    waitTime (int): The maximum time (sec) to wait for the final
+                    result code.
+    terminators (tuple): Lines (prefixes) ending the reply instead of
+                         OK and ERROR, for commands whose result comes
+                         later (e.g. (b'CONNECT OK', b'CONNECT FAIL')).
 
     Returns:
     replyString (string): The reply to the AT command.
     """
-    serialPort.write(bytes(commandString, 'ascii') + b'\r\n')
-    time.sleep(waitTime)
-    replyString: bytes = b''
-    replyChar: bytes  = serialPort.read(1)
-    time.sleep_ms(20)
-    while(replyChar != b"") and (replyChar != None):
-        replyString = replyString + replyChar
-        replyChar = serialPort.read()
-        time.sleep_ms(20)
-    return replyString
-
-
-def https_request(serialPort, method, url, auth=None, data=None):
+    return serialPort.command(commandString, waitTime, terminators)
+
+
+class HttpSession:
+    """
+    HTTP service of the GSM/GPRS module, kept open across requests.
+
+    The bearer (AT+SAPBR) is opened and the HTTP service initialised
+    (AT+HTTPINIT) by the first request only; later requests just set
+    their URL and run. The bearer and service are set up again only
+    when the module reports the bearer dropped (+SAPBR 1: DEACT) or a
+    request is refused or fails with a network error, in which case
+    it is retried once. A request whose result does not arrive in
+    time is not retried, as it may have reached the server.
+
+    Usage:
+        session = HttpSession(gsm_uart)
+        status, length, body = session.request('POST', url, data=payload)
+        session.close()
+
+    Parameters:
+    serialPort (Modem): The GSM/GPRS module.
+    apn (string): The access point name of the mobile data network.
+    """
+
+    def __init__(self, serialPort, apn='ETC'):
+        self.serialPort = serialPort
+        self.apn = apn
+        # bearer profile 1 is open
+        self.bearer_open = False
+        # AT+HTTPINIT done
+        self.http_open = False
+        # auth sent with the current USERDATA, POST content type set
+        self._auth = _UNSET
+        self._content_set = False
+
+    def _command(self, commandString, waitTime=1, terminators=FINAL_RESULTS):
+        """
+        Sends an AT command, noting a dropped bearer in the reply.
+
+        Returns:
+        (bytes): The reply to the AT command.
+        """
+        reply = send_at_command(self.serialPort, commandString, waitTime, terminators)
+        if b'DEACT' in reply:
+            self.bearer_open = False
+            self.http_open = False
+        return reply
+
+    def _open_bearer(self):
+        """
+        Opens bearer profile 1 unless the module reports it open.
+
+        Returns:
+        (boolean): Whether the bearer is open.
+        """
+        if b'+SAPBR: 1,1' in self._command('AT+SAPBR=2,1'):
+            self.bearer_open = True
+            return True
+        self._command('AT+SAPBR=3,1,"Contype","GPRS"')
+        self._command('AT+SAPBR=3,1,"APN","%s"' % self.apn)
+        # may take a while on a weak network
+        self._command('AT+SAPBR=1,1', 30)
+        self.bearer_open = b'+SAPBR: 1,1' in self._command('AT+SAPBR=2,1')
+        return self.bearer_open
+
+    def _open_http(self):
+        """
+        Initialises the HTTP service (ending a stale one first).
+
+        Returns:
+        (boolean): Whether the service is initialised.
+        """
+        if b'OK' not in self._command('AT+HTTPINIT'):
+            # still initialised from before a reset of this object
+            self._command('AT+HTTPTERM')
+            if b'OK' not in self._command('AT+HTTPINIT'):
+                return False
+        self._command('AT+HTTPPARA="CID",1')  # Set bearer profile identifier
+        self._command('AT+HTTPSSL=1')  # set ssl for https
+        self._auth = _UNSET
+        self._content_set = False
+        self.http_open = True
+        return True
+
+    def open(self):
+        """
+        Opens the bearer and the HTTP service if they are not open.
+
+        Returns:
+        (boolean): Whether the session is ready for requests.
+        """
+        if not self.bearer_open:
+            self.http_open = False
+            if not self._open_bearer():
+                return False
+        if not self.http_open:
+            return self._open_http()
+        return True
+
+    def _wait_action(self, timeout):
+        """
+        Waits for the +HTTPACTION: <method>,<status>,<length> result.
+
+        Returns:
+        (tuple): HTTP status and body length, None on timeout.
+        """
+        reply = read_reply(self.serialPort, timeout, (b'+HTTPACTION:',))
+        if b'DEACT' in reply:
+            self.bearer_open = False
+        start = reply.find(b'+HTTPACTION:')
+        if start < 0:
+            return None
+        end = reply.find(b'\n', start)
+        try:
+            fields = reply[start + 12:end].strip().split(b',')
+            return int(fields[1]), int(fields[2])
+        except (IndexError, ValueError):
+            return None
+
+    def read_body(self, length, chunk_size=HTTP_CHUNK, timeout=10):
+        """
+        Yields the body of the last response in chunks read with
+        AT+HTTPREAD=<offset>,<len>, so it can be parsed or stored
+        without holding all of it in RAM.
+
+        Each chunk is a memoryview over one buffer reused for every
+        chunk, valid until the next one is read. The chunks stop early
+        if the module does not answer.
+
+        Parameters:
+        length (int): Body length reported by the request.
+        chunk_size (int): Bytes read per AT+HTTPREAD.
+        timeout (int): Maximum time (sec) to wait for each chunk.
+
+        Yields:
+        (memoryview): The next part of the body.
+        """
+        buffer = memoryview(bytearray(chunk_size))
+        offset = 0
+        while offset < length:
+            count = min(chunk_size, length - offset)
+            with self.serialPort:
+                self.serialPort.write(b'AT+HTTPREAD=%d,%d\r\n' % (offset, count))
+                count = read_http_chunk(self.serialPort, buffer[:count], timeout)
+            if not count:
+                return
+            yield buffer[:count]
+            offset += count
+
+    def _read_body(self, length):
+        """
+        Reads the whole response body.
+
+        Returns:
+        (bytes): The body (shorter than length if reading failed).
+        """
+        body = bytearray(length)
+        offset = 0
+        for chunk in self.read_body(length):
+            body[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return bytes(body[:offset])
+
+    def download(self, url, file_path, auth=None, timeout=HTTP_TIMEOUT):
+        """
+        Runs a GET request and writes the body straight to a file,
+        a chunk at a time.
+
+        Parameters:
+        url (str): https url
+        file_path (str): file to write the body to
+        auth (str): https auth str
+        timeout (int): Maximum time (sec) to wait for the server.
+
+        Returns:
+        (tuple): HTTP status, body length and bytes written (less than
+                 the length if reading failed), None on failure.
+        """
+        response = self.request('GET', url, auth, timeout=timeout, stream=True)
+        if response is None:
+            return None
+        status, length, _ = response
+        written = 0
+        with open(file_path, 'wb') as file:
+            for chunk in self.read_body(length):
+                file.write(chunk)
+                written += len(chunk)
+        return status, length, written
+
+    def _run(self, method, url, auth, data, timeout, stream):
+        """
+        Runs one request over the open session.
+
+        Returns:
+        (tuple): HTTP status, body length and body, None if the module
+                 refused the request, _NO_RESULT if it accepted it but
+                 did not report its result.
+        """
+        self._command('AT+HTTPPARA="URL","%s"' % url)
+        if auth != self._auth:
+            self._command('AT+HTTPPARA="USERDATA", "Connection: keep-alive"')
+            if auth is not None:
+                self._command('AT+HTTPPARA="USERDATA", "Authorization:Basic %s"' % auth)
+            self._auth = auth
+        if method == "POST":
+            if not self._content_set:
+                self._command('AT+HTTPPARA="CONTENT","application/json"')
+                self._content_set = True
+            reply = self._command(f'AT+HTTPDATA={len(data)},10000', 1,
+                                  (b'DOWNLOAD',))  # Specify data length
+            if b'DOWNLOAD' not in reply:
+                # the body would be taken for commands
+                return None
+            self.serialPort.write(data)
+            read_reply(self.serialPort, 10)
+            reply = self._command('AT+HTTPACTION=1')  # 1 for POST
+        else:
+            reply = self._command('AT+HTTPACTION=0')  # 0 for GET
+        if b'OK' not in reply:
+            return None
+        result = self._wait_action(timeout)
+        if result is None:
+            return _NO_RESULT
+        status, length = result
+        if stream:
+            return status, length, None
+        body = self._read_body(length) if length else b''
+        return status, length, body
+
+    def request(self, method, url, auth=None, data=None, timeout=HTTP_TIMEOUT,
+                stream=False):
+        """
+        Sends an HTTPS request, setting the session up first if needed,
+        and returns as soon as the module reports the result.
+
+        Parameters:
+        method (str): https method 'POST' or 'GET'
+        url (str): https url
+        auth (str): https auth str
+        data (str): data string to be sent
+        timeout (int): Maximum time (sec) to wait for the server.
+        stream (bool): Leave the body to read_body() (body is None).
+
+        Returns:
+        (tuple): HTTP status (6xx for errors reported by the module),
+                 body length and body (bytes), None if both attempts
+                 failed or no result arrived in time.
+        """
+        response = None
+        # commands posted by URC handlers wait for the request
+        with self.serialPort:
+            for attempt in range(2):
+                if not self.open():
+                    continue
+                response = self._run(method, url, auth, data, timeout, stream)
+                if response is _NO_RESULT:
+                    # the request may have reached the server, so it is not
+                    # sent again; the module may still be busy with it
+                    self.http_open = False
+                    return None
+                # 6xx: network errors reported by the module
+                if response is not None and response[0] < 600:
+                    return response
+                # set everything up again for the retry
+                self.bearer_open = False
+                self.http_open = False
+        return response
+
+    def close(self):
+        """
+        Terminates the HTTP service and closes the bearer.
+        """
+        if self.http_open:
+            self._command('AT+HTTPTERM')
+        if self.bearer_open:
+            self._command('AT+SAPBR=0,1', 10)
+        self.http_open = False
+        self.bearer_open = False
+
+
+# session used by https_request()
+_session = None
+
+
+def _get_session(serialPort):
+    """ Returns the cached session for a modem.
+    """
+    global _session
+    if _session is None or _session.serialPort is not serialPort:
+        _session = HttpSession(serialPort)
+    return _session
+
+
+def https_request(serialPort, method, url, auth=None, data=None, timeout=HTTP_TIMEOUT):
     """ simple example function to send http request
 
+    The bearer and HTTP service are kept open between calls on the
+    same modem (see HttpSession).
+
     Paramenters:
-        serialPort (uart): The UART interface to the GSM/GPRS module.
+        serialPort (Modem): The GSM/GPRS module.
         method (str): https method 'POST' or 'GET'
         url (str): https url
         auth (str): https auth str
         data (str): data string to be sent
+        timeout (int): maximum time (sec) to wait for the server
         
     Returns:
-        http response (byte str)
+        (status, length, body) tuple, None on failure
     """
-    # Initialize GPRS
-    send_at_command(serialPort, 'AT+SAPBR=3,1,"Contype","GPRS"', 1)
-    send_at_command(serialPort, 'AT+SAPBR=3,1,"APN","ETC"', 1)
-    send_at_command(serialPort, 'AT+SAPBR=1,1', 1)
-    send_at_command(serialPort, 'AT+SAPBR=2,1', 1)
-
-    
-    send_at_command(serialPort, 'AT+HTTPINIT', 1) # init http
-    send_at_command(serialPort, 'AT+HTTPPARA="CID",1', 1)  # Set bearer profile identifier
-    send_at_command(serialPort, f'AT+HTTPPARA="URL","{url}"', 1)
-    send_at_command(serialPort,  'AT+HTTPPARA="USERDATA", "Connection: keep-alive"', 1)
-    if auth is not None:
-        send_at_command(serialPort, 'AT+HTTPPARA="USERDATA", "Authorization:Basic %s"'%auth, 1)
-    
-    send_at_command(serialPort, 'AT+HTTPSSL=1', 1)  # set ssl for https
-
-    if method == "POST":
-        send_at_command(serialPort, 'AT+HTTPPARA="CONTENT","application/json"', 1)
-        send_at_command(serialPort, f'AT+HTTPDATA={len(data)},10000', 1)  # Specify data length
-        serialPort.write(data)
-        time.sleep(2)
-        send_at_command(serialPort, 'AT+HTTPACTION=1', 1)  # 1 for POST
-    else:
-        send_at_command(serialPort, 'AT+HTTPACTION=0', 1)  # 0 for GET
-
-    time.sleep(10)
-    response = send_at_command(serialPort, 'AT+HTTPREAD', 1)  # Read server response
-    
-    send_at_command(serialPort, 'AT+HTTPTERM', 1)  # Terminate HTTP session
-    
-    return response
+    return _get_session(serialPort).request(method, url, auth, data, timeout)
+
+
+def https_download(serialPort, url, file_path, auth=None, timeout=HTTP_TIMEOUT):
+    """ Downloads a file over HTTPS with constant memory use.
+
+    Paramenters:
+        serialPort (Modem): The GSM/GPRS module.
+        url (str): https url
+        file_path (str): file to write the body to
+        auth (str): https auth str
+        timeout (int): maximum time (sec) to wait for the server
+
+    Returns:
+        (status, length, bytes written) tuple, None on failure
+    """
+    return _get_session(serialPort).download(url, file_path, auth, timeout)
 
 
 def set_ssl(uart):
@@ -88,7 +490,7 @@ def set_ssl(uart):
     Configures the module to communicate over SSL.
 
     Paramenters:
-    uart (uart): The UART interface to the GSM/GPRS module.
+    uart (Modem): The GSM/GPRS module.
 
     Returns:
     ssl_status (string): The result of the At command to set SSL connectivity.
@@ -107,19 +509,17 @@ def extract_http_payload(file_data):
     Returns:
     file_data_payload (string): The extracted HTTP data.
     """
-    # get content length from between Content-Length and Keep-Alive strings
+    parser = HttpParser()
     try:
-        s_1 = re.search(b'Content-Length: [0-9]+\r\n', file_data)
-        s_2 = re.search('[0-9]+', s_1.group(0))
-        data_offset = int(s_2.group(0))
-        if b'CLOSED' in file_data:
-            file_data_payload = file_data[-data_offset-10:-10]
-        else:
-            file_data_payload = file_data[-data_offset:-1]
-
-        return file_data_payload
-    except:
+        parser.feed(file_data)
+    except (ValueError, IndexError):
+        # malformed status line, length or chunk size
+        return None
+    # the data ends with the response, so the connection closed
+    parser.finish()
+    if not parser.done:
         return None
+    return bytes(parser.body)
 
 
 def init_simcom(uart):
@@ -127,7 +527,7 @@ def init_simcom(uart):
     Activate the GSM/GPRS module.
 
     Parameters:
-    uart (uart): The UART interface to the GSM/GPRS module.
+    uart (Modem): The GSM/GPRS module.
 
     Returns:
     init_status (string): The result of the command to activate.
@@ -144,7 +544,7 @@ def init_simcom_gprs(serialPort, timeout=5):
     Activate mobile data on the GSM/GPRS module.
 
     Parameters:
-    serialPort (uart): The UART interface to the GSM/GPRS module.
+    serialPort (Modem): The GSM/GPRS module.
     timeout (int): Maximum time (sec) to wait for activation.
 
     Returns:
@@ -170,7 +570,7 @@ def init_simcom_http(serialPort, connection_attempts=10,
     Initialize an HTTPS session.
 
     Parameters:
-    serialPort (uart): The UART interface to the GSM/GPRS module.
+    serialPort (Modem): The GSM/GPRS module.
     connection_attempts (int): Number of tries to initiate the session.
     ip_address (string): The server ip address (or host name).
     port (string): The port to connect (443 is standard https port).
@@ -178,13 +578,13 @@ def init_simcom_http(serialPort, connection_attempts=10,
     Returns:
     (boolean): Success or faliure of the attempt.
     """
-    serialPort.read()
     no_tries = 0
     result = b''
     while no_tries < connection_attempts and ((b'CONNECT OK' not in result) and (b'ALREADY CONNECT' not in result)):
         print('Connecting to server...', result)
         result = send_at_command(
-            serialPort, 'at+cipstart="TCP","' + str(ip_address, 'ascii') + '","' + port + '"', 2)
+            serialPort, 'at+cipstart="TCP","' + str(ip_address, 'ascii') + '","' + port + '"', 10,
+            (b'CONNECT OK', b'ALREADY CONNECT', b'CONNECT FAIL'))
         no_tries += 1
     print('at+cipstart="TCP","' + str(ip_address, 'ascii') + '","' + port + '"')
     #return result
@@ -196,49 +596,69 @@ def init_simcom_http(serialPort, connection_attempts=10,
 def send_simcom_http_query(serialPort,
         url_path='/ayer_admin/order', 
         keep_alive=True,
-        empty_read_count=100):
+        empty_read_count=100,
+        parser=None):
     """
     Sends an HTTPS request.
 
     Parameters:
-    serialPort (uart): The UART interface to the GSM/GPRS module.
+    serialPort (Modem): The GSM/GPRS module.
     url_parth (string): The url path for the request.
     keep_alive (bool): Include/Not-include keep-alive request in the http header.
     empty_read_count (int): number of empty data reads before terminating the request.
+    parser (HttpParser): parser fed with the response, e.g. to stream the
+                         body through its on_body (a new one by default).
 
     Returns:
     http_data (string): The data returned by the server for the HTTPS request.
+                        Throughput counters are left in http_stats.
     """
-    connect_wait = 0
-    result = b''
-    while connect_wait < 50 and b'>' not in result:
-        # print('Connecting to HTTP server...')
-        result = send_at_command(serialPort, b'at+cipsend', 1)
-        connect_wait += 1
-        time.sleep(0.2)
-    if result == b'':
-        return b''
-    serialPort.write(b'GET ' + url_path + b' HTTP/1.0\r\n')
-    if keep_alive:
-        serialPort.write('Connection: keep-alive\r\n')
-    serialPort.write('\r\n\r\n\x1a')
-    time.sleep(0.5)
-    httpResult = serialPort.read(128)
-    time.sleep(0.1)
-    http_data = b''
-    empty_read_counts = 0
-    while empty_read_counts < empty_read_count:
-        # print('HTTP Result: ', httpResult)
-        httpResult = serialPort.read(128)
-        if httpResult is None:
+    # commands posted by URC handlers wait for the response
+    with serialPort:
+        connect_wait = 0
+        result = b''
+        while connect_wait < 50 and b'>' not in result:
+            # print('Connecting to HTTP server...')
+            result = send_at_command(serialPort, b'at+cipsend', 1)
+            connect_wait += 1
+            time.sleep(0.2)
+        if result == b'':
+            return b''
+        if parser is None:
+            # the response is returned whole, the parser only finds its end
+            parser = HttpParser(on_body=lambda fragment: None)
+        serialPort.write(b'GET ' + url_path + b' HTTP/1.0\r\n')
+        if keep_alive:
+            serialPort.write('Connection: keep-alive\r\n')
+        serialPort.write('\r\n\r\n\x1a')
+        http_stats.reset()
+        start = time.ticks_ms()
+        _rx.clear()
+        http_data = bytearray()
+        empty_read_counts = 0
+        # only the bytes just received are passed to the parser, which
+        # ends the loop as soon as it has the whole body
+        while empty_read_counts < empty_read_count and not parser.done:
+            received = _rx.fill(serialPort)
+            if len(received):
+                http_data.extend(received)
+                _rx.consume(len(received))
+                http_stats.bytes += len(received)
+                empty_read_counts = 0
+                try:
+                    parser.feed(received)
+                except (ValueError, IndexError):
+                    # not a valid HTTP response, keep what arrived
+                    break
+                continue
             empty_read_counts = empty_read_counts + 1
-        if httpResult is not None:
-            http_data = http_data + httpResult
-            if b'CLOSED' in http_data:
-                break
-            empty_read_counts = 0
-        time.sleep(0.1)
-    return http_data
+            idle_start = time.ticks_ms()
+            serialPort.wait(_IDLE_MS)
+            http_stats.idle_ms += time.ticks_diff(time.ticks_ms(), idle_start)
+        http_stats.elapsed_ms = time.ticks_diff(time.ticks_ms(), start)
+        if not parser.done:
+            parser.finish()
+        return bytes(http_data)
 
 
 def get_ntp_time(uart):
@@ -246,14 +666,13 @@ def get_ntp_time(uart):
     Get the Network Time Protocol (NTP) time.
 
     Parameters:
-    uart (uart): The UART interface to the GSM/GPRS module.
+    uart (Modem): The GSM/GPRS module.
 
     Returns:
     ntp_time (string): The NTP date and time.
     """
     network_register_status = register_network(uart, timeout=5)
     #print('Registration Status: ', network_register_status)
-    time.sleep(3)
     data_connect_status = init_simcom_gprs(uart)
     #print('Data Connect Status: ', data_connect_status)
     if data_connect_status != None:
@@ -263,7 +682,7 @@ def get_ntp_time(uart):
         #send_at_command(uart, 'AT+CNTP="0.africa.pool.ntp.org", 12', 1)
         send_at_command(uart, 'AT+CNTP="time.google.com", 12', 1)
         #print('Set NTP service...')
-        send_at_command(uart, 'AT+CNTP', 1)
+        send_at_command(uart, 'AT+CNTP', 10, (b'+CNTP:',))
         #print('Sync NTP time...')
         ntp_time = send_at_command(uart, 'AT+CCLK?', 1)
         return ntp_time
@@ -0,0 +1,203 @@
+"""
+Incremental HTTP/1.x response parser.
+
+Bytes are pushed with feed() as they arrive from the UART, in
+pieces of any size; the parser keeps track of the status line,
+the headers and the body and hands body fragments to on_body as
+memoryview slices of the data fed, without copying them. The
+body may be delimited by Content-Length, sent with chunked
+transfer encoding, or run until the connection closes, which the
+SIM808 reports by appending the CLOSED marker to the data; the
+last bytes of such a body are held back until it is clear they
+are not the marker.
+
+Lines before the status line (command echoes, SEND OK, ...) are
+skipped, and whatever follows the end of the body is not read.
+
+Usage:
+    parser = HttpParser()
+    while not parser.done:
+        parser.feed(uart.read(128) or b'')
+    print(parser.status, parser.headers, bytes(parser.body))
+"""
+
+# data appended by the SIM808 when the server closes the connection
+CLOSED_MARKER = b'\r\nCLOSED\r\n'
+
+# parser states
+_STATUS = 0
+_HEADERS = 1
+_BODY = 2
+_CHUNK_SIZE = 3
+_CHUNK_DATA = 4
+_CHUNK_END = 5
+_TRAILERS = 6
+_CLOSE_BODY = 7
+_DONE = 8
+
+
+class HttpParser:
+    """ Push-style parser for one HTTP/1.x response.
+
+    Parameters:
+        on_body (function): called with each body fragment (a
+                            memoryview, valid during the call);
+                            by default fragments are collected
+                            in the body attribute
+        close_marker (bytes): data marking the end of the stream
+                              for bodies delimited by the
+                              connection close
+    """
+
+    def __init__(self, on_body=None, close_marker=CLOSED_MARKER):
+        self.on_body = on_body
+        self.close_marker = close_marker
+        # status code (None until the status line is parsed)
+        self.status = None
+        # lower case header name -> value (bytes)
+        self.headers = {}
+        # collected body, if there is no on_body
+        self.body = bytearray()
+        # the whole body has been parsed
+        self.done = False
+        self._state = _STATUS
+        # incomplete line (status line, headers, chunk sizes)
+        self._line = bytearray()
+        # body or chunk bytes still expected
+        self._remaining = 0
+        # last bytes of a close delimited body, held back
+        self._held = b''
+
+    def _emit(self, fragment):
+        """ Hands a body fragment over.
+        """
+        if not len(fragment):
+            return
+        if self.on_body is None:
+            self.body.extend(fragment)
+        else:
+            self.on_body(fragment)
+
+    def _read_line(self, raw, data, pos):
+        """ Collects bytes up to the next line end.
+
+        Returns:
+            (tuple) the line without its end (None if the line
+                    is not complete yet) and the next position
+        """
+        end = raw.find(b'\n', pos)
+        if end < 0:
+            self._line.extend(data[pos:])
+            return None, len(data)
+        self._line.extend(data[pos:end])
+        line = bytes(self._line).rstrip(b'\r')
+        self._line = bytearray()
+        return line, end + 1
+
+    def _end_headers(self):
+        """ Picks the body framing once the headers are parsed.
+        """
+        if self.status < 200 or self.status in (204, 304):
+            self._finish()
+        elif b'chunked' in self.headers.get(b'transfer-encoding', b'').lower():
+            self._state = _CHUNK_SIZE
+        elif b'content-length' in self.headers:
+            self._remaining = int(self.headers[b'content-length'])
+            self._state = _BODY
+            if not self._remaining:
+                self._finish()
+        else:
+            self._state = _CLOSE_BODY
+
+    def _finish(self):
+        """ Marks the response as complete.
+        """
+        self._state = _DONE
+        self.done = True
+
+    def _feed_close_body(self, data):
+        """ Passes on a close delimited body, holding back as many
+            bytes as the close marker in case they are the marker.
+        """
+        held = self._held
+        keep = min(len(self.close_marker), len(held) + len(data))
+        count = len(held) + len(data) - keep
+        from_held = min(count, len(held))
+        self._emit(memoryview(held)[:from_held])
+        self._emit(data[:count - from_held])
+        self._held = held[from_held:] + bytes(data[count - from_held:])
+        if self._held == self.close_marker:
+            self._held = b''
+            self._finish()
+
+    def feed(self, data):
+        """ Parses the next bytes of the response.
+
+        Parameters:
+            data (bytes): bytes as received
+
+        Returns:
+            (int) number of bytes used (less than len(data) if
+                  the response ended within them)
+        """
+        # data to split lines with find(), which memoryviews lack
+        # (only copied if a line is to be read from a memoryview)
+        raw = None if isinstance(data, memoryview) else data
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data) and not self.done:
+            state = self._state
+            if state == _CLOSE_BODY:
+                self._feed_close_body(data[pos:])
+                pos = len(data)
+            elif state in (_BODY, _CHUNK_DATA):
+                count = min(self._remaining, len(data) - pos)
+                self._emit(data[pos:pos + count])
+                pos += count
+                self._remaining -= count
+                if not self._remaining:
+                    if state == _BODY:
+                        self._finish()
+                    else:
+                        self._state = _CHUNK_END
+            else:
+                if raw is None:
+                    raw = bytes(data)
+                line, pos = self._read_line(raw, data, pos)
+                if line is not None:
+                    self._parse_line(line)
+        return pos
+
+    def _parse_line(self, line):
+        """ Handles a complete line of the status line, headers or
+            chunk framing.
+        """
+        state = self._state
+        if state == _STATUS:
+            # skip whatever the module sends before the response
+            if line.startswith(b'HTTP/'):
+                self.status = int(line.split()[1])
+                self._state = _HEADERS
+        elif state == _HEADERS:
+            if not line:
+                self._end_headers()
+            else:
+                name, _, value = line.partition(b':')
+                self.headers[name.strip().lower()] = value.strip()
+        elif state == _CHUNK_SIZE:
+            self._remaining = int(line.split(b';')[0].strip(), 16)
+            self._state = _CHUNK_DATA if self._remaining else _TRAILERS
+        elif state == _CHUNK_END:
+            self._state = _CHUNK_SIZE
+        elif state == _TRAILERS:
+            if not line:
+                self._finish()
+
+    def finish(self):
+        """ Ends a close delimited body when the connection closed
+            without the marker (e.g. no more data arrives).
+        """
+        if self._state == _CLOSE_BODY:
+            self._emit(memoryview(self._held))
+            self._held = b''
+            self._finish()
@@ -0,0 +1,182 @@
+"""
+Write-ahead journal for the database module.
+
+Every change is appended to the journal before it is made in
+the btree, and each flush ends with a commit entry carrying an
+increasing transaction id, which is also stored in the btree.
+If power drops before the btree flush completes, the next open
+replays the committed transactions whose id is newer than the
+one found in the btree, and drops the uncommitted tail. Along
+with the id, the btree stores the journal size after the
+commit entry, so recovery only reads the journal from there;
+the journal is reset whenever it grows over a size limit.
+
+Entries are laid out as:
+
+    op (1 byte) key length (2 bytes) value length (4 bytes)
+    key value CRC-32 (4 bytes)
+
+all little endian, with the CRC (from the crccheck package)
+over everything before it. For a commit entry the key holds
+the transaction id and the value is empty. Reading stops at
+the first entry that is short or fails its CRC, i.e. one torn
+by the power loss.
+
+Usage:
+    journal = Journal('store.db.jnl')
+    transactions = journal.recover(last_txid, offset)
+    if transactions or journal.committed < journal.size():
+        ...  # apply the changes, store the last txid, flush
+        journal.reset()
+    journal.set(b'key', b'value')
+    journal.commit(last_txid + 1)
+    # store last_txid + 1 and journal.size() in the btree, flush
+"""
+
+import struct
+from crccheck.crc import Crc32
+
+SET = 1
+DELETE = 2
+COMMIT = 3
+
+_HEADER = '<BHI'
+_HEADER_SIZE = struct.calcsize(_HEADER)
+# bytes of journal above which reset() is worth a write
+LIMIT = 16 * 1024
+
+
+class Journal:
+    """ Append-only journal file of btree changes.
+
+    Parameters:
+        path (str): journal file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._file = open(path, "r+b")
+        except OSError:
+            self._file = open(path, "w+b")
+        self._file.seek(0, 2)
+        self._size = self._file.tell()
+        # bytes up to the end of the last commit entry, set by
+        # recover()
+        self.committed = self._size
+
+    def _append(self, op, key, value):
+        """ Appends one entry (not flushed).
+        """
+        # btree also takes str (the counters are stored as text)
+        if isinstance(key, str):
+            key = key.encode()
+        if isinstance(value, str):
+            value = value.encode()
+        header = struct.pack(_HEADER, op, len(key), len(value))
+        crc = Crc32().process(header).process(key).process(value).final()
+        self._file.write(header)
+        self._file.write(key)
+        self._file.write(value)
+        self._file.write(struct.pack('<I', crc))
+        self._size += _HEADER_SIZE + len(key) + len(value) + 4
+
+    def set(self, key, value):
+        """ Records that key is set to value.
+        """
+        self._append(SET, key, value)
+
+    def delete(self, key):
+        """ Records that key is deleted.
+        """
+        self._append(DELETE, key, b'')
+
+    def commit(self, txid):
+        """ Ends a transaction and makes the journal durable,
+            before the btree is flushed.
+
+        Parameters:
+            txid (int): transaction id, larger than any before
+        """
+        self._append(COMMIT, b'%d' % txid, b'')
+        self._file.flush()
+
+    def size(self):
+        """ Returns the size of the journal in bytes.
+        """
+        return self._size
+
+    def _read(self):
+        """ Reads the next entry.
+
+        Returns:
+            (tuple) op, key and value, or None at the end of
+                    the journal or at a torn entry
+        """
+        header = self._file.read(_HEADER_SIZE)
+        if len(header) < _HEADER_SIZE:
+            return None
+        op, key_size, value_size = struct.unpack(_HEADER, header)
+        if op not in (SET, DELETE, COMMIT):
+            return None
+        key = self._file.read(key_size)
+        value = self._file.read(value_size)
+        crc = self._file.read(4)
+        if len(key) < key_size or len(value) < value_size or len(crc) < 4:
+            return None
+        if struct.unpack('<I', crc)[0] != Crc32().process(header).process(key).process(value).final():
+            return None
+        return op, key, value
+
+    def recover(self, last_txid, offset=0):
+        """ Reads the committed transactions newer than last_txid.
+            If there are any, or anything follows the last commit
+            (a torn or uncommitted tail), the caller applies them,
+            flushes the btree and calls reset() before appending.
+
+        Parameters:
+            last_txid (int): transaction id stored in the btree
+            offset (int): journal size after that commit (from
+                          the start if past the end, i.e. from
+                          before a reset)
+
+        Returns:
+            (list) (txid, changes) tuples in commit order, where
+                   changes is a list of (op, key, value)
+        """
+        if offset > self._size:
+            offset = 0
+        transactions = []
+        changes = []
+        self.committed = offset
+        self._file.seek(offset)
+        while True:
+            entry = self._read()
+            if entry is None:
+                break
+            op, key, value = entry
+            if op != COMMIT:
+                changes.append(entry)
+                continue
+            txid = int(key)
+            if txid > last_txid:
+                transactions.append((txid, changes))
+            changes = []
+            self.committed = self._file.tell()
+        self._file.seek(0, 2)
+        return transactions
+
+    def reset(self):
+        """ Empties the journal, once everything in it is in
+            the flushed btree.
+        """
+        # MicroPython files have no truncate()
+        self._file.close()
+        self._file = open(self.path, "w+b")
+        self._size = 0
+        self.committed = 0
+
+    def close(self):
+        """ Closes the journal file.
+        """
+        self._file.close()
@@ -0,0 +1,349 @@
+"""
+Shared access to the SIM808 GSM/GPRS module.
+
+The module sits on UART(1) (rx=27, tx=14), and only one object
+may read it: a second UART on the same pins steals the replies
+the first one waits for. get_modem() returns the one Modem
+owning the UART, which sim808, sms and gprs all use.
+
+Modem.command() sends an AT command and returns its reply as
+soon as the final result code (OK, ERROR, +CME ERROR, +CMS ERROR
+or the > data prompt) arrives. Unsolicited result codes (URCs)
+such as +CMTI, +HTTPACTION, +CREG or CLOSED that arrive while
+waiting are handed to the callbacks registered with on() for
+their prefix, instead of ending up in the reply; poll() does the
+same between commands. Callbacks must not wait for the module
+themselves: they queue commands with post(), which run in order
+once the current command is done.
+
+Exchanges of more than one command (a command, raw data, then
+its reply read with read_until()) run in a with modem: block, so
+that posted commands wait until the whole exchange is over.
+
+Raw bytes (data after a prompt, HTTP response data, AT+HTTPREAD
+bodies) go through write() and readinto(), so the Modem can stand
+in for the UART where bytes are not lines.
+
+Usage:
+    modem = get_modem()
+    modem.on(b'+CMTI:', lambda line: modem.post('AT+CMGR=' + ...))
+    reply = modem.command('AT+CREG?')
+    modem.poll()
+    with modem:
+        if modem.command('AT+CMGS="+256..."', 5).strip().endswith(b'>'):
+            modem.write(text + '\x1a')
+            reply = modem.read_until(timeout=60)
+"""
+
+import time
+import select
+from machine import UART
+
+# lines ending the reply to an AT command
+FINAL_RESULTS = (b'OK', b'ERROR')
+# error lines, which end the reply whatever it waits for
+ERROR_RESULTS = (b'ERROR', b'+CME ERROR', b'+CMS ERROR')
+# prompt of the commands taking data (AT+CIPSEND, AT+CMGS)
+PROMPT = b'>'
+# wait between reads if the UART cannot be polled (ms)
+_POLL_MS = 5
+
+
+def _starts_with(line, prefixes):
+    """ Whether line starts with one of prefixes (MicroPython's
+        startswith() takes no tuple).
+    """
+    for prefix in prefixes:
+        if line.startswith(prefix):
+            return True
+    return False
+
+
+class Modem:
+    """ The GSM/GPRS module behind its UART.
+
+    Parameters:
+        uart (UART): the UART interface to the module
+    """
+
+    def __init__(self, uart):
+        self.uart = uart
+        # (prefix, callback) of the URC handlers
+        self._handlers = []
+        # (command, timeout, terminators, callback) posted
+        self._queue = []
+        # a command is running
+        self._busy = False
+        # depth of the with blocks running an exchange
+        self._held = 0
+        # received bytes, consumed up to _pos, searched for line
+        # ends up to _scan (MicroPython's bytearray has no find())
+        self._rx = bytearray()
+        self._pos = 0
+        self._scan = 0
+        self._chunk = bytearray(128)
+        try:
+            self._poller = select.poll()
+            self._poller.register(uart, select.POLLIN)
+        except Exception:
+            self._poller = None
+
+    def on(self, prefix, callback):
+        """ Registers a callback for the URCs starting with prefix
+            (e.g. b'+CMTI:'); it is called with the line (bytes).
+        """
+        self._handlers.append((prefix, callback))
+
+    def off(self, prefix, callback=None):
+        """ Removes the callbacks of prefix (only callback if given).
+        """
+        self._handlers = [(p, c) for p, c in self._handlers
+                          if p != prefix or (callback is not None and c is not callback)]
+
+    def _dispatch(self, line):
+        """ Hands a line to the URC handlers of its prefix.
+
+        Returns:
+            (boolean) whether a handler took it
+        """
+        handled = False
+        for prefix, callback in self._handlers:
+            if line.startswith(prefix):
+                callback(line)
+                handled = True
+        return handled
+
+    def _receive(self, timeout_ms):
+        """ Reads what the UART has, waiting up to timeout_ms for
+            something to arrive.
+
+        Returns:
+            (boolean) whether bytes arrived
+        """
+        count = self.uart.readinto(self._chunk)
+        if count:
+            # drop the consumed bytes once they are most of the buffer,
+            # so each byte is copied a bounded number of times
+            if self._pos > len(self._rx) // 2:
+                self._rx = self._rx[self._pos:]
+                self._scan -= self._pos
+                self._pos = 0
+            self._rx.extend(memoryview(self._chunk)[:count])
+            return True
+        if timeout_ms > 0:
+            self.wait(timeout_ms)
+        return False
+
+    def _line_end(self):
+        """ Returns the position of the end of the next received
+            line, -1 if no complete line was received.
+        """
+        if self._scan < self._pos:
+            self._scan = self._pos
+        # only the bytes not searched yet are copied
+        end = bytes(memoryview(self._rx)[self._scan:]).find(b'\n')
+        if end < 0:
+            self._scan = len(self._rx)
+            return -1
+        return self._scan + end
+
+    def _pending(self):
+        """ Returns the received bytes not consumed yet.
+        """
+        return self._rx[self._pos:]
+
+    def _take(self, count):
+        """ Consumes count received bytes.
+        """
+        self._pos += count
+        if self._pos >= len(self._rx):
+            self._rx = bytearray()
+            self._pos = 0
+            self._scan = 0
+
+    def wait(self, timeout_ms):
+        """ Waits up to timeout_ms for data from the module (not at
+            all if a complete line or a prompt was received already;
+            a partial line, e.g. a command echo, does not count).
+        """
+        if self._line_end() >= 0 or bytes(self._pending()).strip() == PROMPT:
+            return
+        if self._poller is not None:
+            self._poller.poll(timeout_ms)
+            return
+        start = time.ticks_ms()
+        while not self.uart.any():
+            remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0:
+                break
+            time.sleep_ms(min(remaining, _POLL_MS))
+
+    def read_until(self, terminators=FINAL_RESULTS, timeout=1, own=None):
+        """ Reads lines until one starting with one of the
+            terminators (or an error line, or a data prompt)
+            arrives. URC lines with a handler go to it rather than
+            to the reply, unless they are what is waited for (or
+            start with own, the response prefix of the command).
+
+        Parameters:
+            terminators (tuple): lines (prefixes) ending the reply
+            timeout (float): maximum time (sec) to wait
+            own (bytes): prefix of the command's own response lines
+
+        Returns:
+            (bytes) the reply, up to the end of the terminating line
+                    (all that arrived if the timeout expired)
+        """
+        reply = bytearray()
+        start = time.ticks_ms()
+        timeout_ms = int(timeout * 1000)
+        while True:
+            while True:
+                end = self._line_end()
+                if end < 0:
+                    break
+                line = bytes(self._rx[self._pos:end + 1])
+                self._take(end + 1 - self._pos)
+                stripped = line.strip()
+                if _starts_with(stripped, terminators + ERROR_RESULTS):
+                    reply.extend(line)
+                    return bytes(reply)
+                if (own is None or not stripped.startswith(own)) and self._dispatch(stripped):
+                    continue
+                reply.extend(line)
+            # a prompt is not followed by a line end
+            if bytes(self._pending()).strip() == PROMPT:
+                break
+            remaining = timeout_ms - time.ticks_diff(time.ticks_ms(), start)
+            if remaining <= 0:
+                break
+            self._receive(remaining)
+        reply.extend(self._pending())
+        self._take(len(self._rx))
+        return bytes(reply)
+
+    def _drain(self):
+        """ Dispatches the URCs received before a command, and drops
+            the rest (late replies to earlier commands).
+        """
+        self._receive(0)
+        while True:
+            end = self._line_end()
+            if end < 0:
+                break
+            line = bytes(self._rx[self._pos:end]).strip()
+            self._take(end + 1 - self._pos)
+            self._dispatch(line)
+
+    def _run(self, command, timeout, terminators):
+        """ Sends a command and reads its reply.
+        """
+        if isinstance(command, str):
+            command = command.encode()
+        self._drain()
+        self.uart.write(command + b'\r\n')
+        # AT+CREG? -> +CREG:
+        name = command.split(b'=')[0].split(b'?')[0].strip()
+        own = b'+' + name[3:].upper() + b':' if name[2:3] == b'+' else None
+        return self.read_until(terminators, timeout, own)
+
+    def command(self, command, timeout=1, terminators=FINAL_RESULTS):
+        """ Sends an AT command and returns its reply.
+
+        Parameters:
+            command (str): AT command, without the line end
+            timeout (float): maximum time (sec) to wait for the reply
+            terminators (tuple): lines (prefixes) ending the reply
+                                 instead of OK and ERROR, for commands
+                                 whose result comes later
+
+        Returns:
+            (bytes) the reply (up to the timeout if it did not end)
+        """
+        if self._busy:
+            raise RuntimeError('modem busy, post() commands from callbacks')
+        self._busy = True
+        try:
+            reply = self._run(command, timeout, terminators)
+        finally:
+            self._busy = False
+        self._run_queue()
+        return reply
+
+    def post(self, command, callback=None, timeout=1, terminators=FINAL_RESULTS):
+        """ Queues a command, run once the current one (if any) and
+            the current exchange (with block) are done; callback is
+            called with its reply.
+        """
+        self._queue.append((command, timeout, terminators, callback))
+        self._run_queue()
+
+    def __enter__(self):
+        """ Starts an exchange: posted commands wait for its end.
+        """
+        self._held += 1
+        return self
+
+    def __exit__(self, *args):
+        """ Ends an exchange and runs the commands posted meanwhile.
+        """
+        self._held -= 1
+        self._run_queue()
+
+    def _run_queue(self):
+        """ Runs the posted commands in order.
+        """
+        while self._queue and not self._busy and not self._held:
+            command, timeout, terminators, callback = self._queue.pop(0)
+            self._busy = True
+            try:
+                reply = self._run(command, timeout, terminators)
+            finally:
+                self._busy = False
+            if callback is not None:
+                callback(reply)
+
+    def poll(self):
+        """ Dispatches the URCs received since the last command and
+            runs the posted commands; call it from the main loop.
+        """
+        if not self._busy and not self._held:
+            self._drain()
+            self._run_queue()
+
+    def write(self, data):
+        """ Sends raw bytes (e.g. data after a > prompt).
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        return self.uart.write(data)
+
+    def readinto(self, buffer, count=None):
+        """ Reads raw bytes, the ones already received first (not
+            split into lines or checked for URCs).
+
+        Returns:
+            (int) number of bytes read, None if none were available
+        """
+        buffer = memoryview(buffer)
+        if count is not None:
+            buffer = buffer[:count]
+        if self._pos < len(self._rx):
+            count = min(len(buffer), len(self._rx) - self._pos)
+            buffer[:count] = self._rx[self._pos:self._pos + count]
+            self._take(count)
+            return count
+        return self.uart.readinto(buffer)
+
+
+# the modem on UART(1), created by get_modem()
+_modem = None
+
+
+def get_modem():
+    """ Returns the modem, opening UART(1) on first use.
+    """
+    global _modem
+    if _modem is None:
+        _modem = Modem(UART(1, baudrate=9600, bits=8, parity=None, stop=1, rx=27, tx=14))
+    return _modem
@@ -0,0 +1,405 @@
+"""
+Asynchronous driver of the SIM808 GSM/GPRS module.
+
+The functions of gprs.py, sim808.py and sms.py block the only
+core while they wait for the module, freezing the display, the
+NFC reader and the buttons for the length of an HTTPS request.
+AsyncModem talks to the module through asyncio streams instead,
+so every wait yields to the other tasks.
+
+It runs on uasyncio (a StreamReader/StreamWriter over the UART,
+see from_uart()) and on CPython's asyncio, where any stream pair
+will do, e.g. one over a pty with a fake modem on the other side
+(see open_serial()).
+
+Usage:
+    modem = AsyncModem.from_uart(UART(1, 9600, rx=27, tx=14))
+    if await modem.register():
+        status, body = await modem.http_get('https://...')
+        await modem.send_sms('+256700000000', 'Payment received')
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+import time
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+# lines ending the reply to an AT command
+FINAL_RESULTS = (b'OK', b'ERROR')
+# error lines, which end the reply whatever it waits for
+ERROR_RESULTS = (b'ERROR', b'+CME ERROR', b'+CMS ERROR')
+# prompt of the commands taking data (AT+CMGS, AT+CIPSEND)
+PROMPT = b'>'
+# time to wait for the +HTTPACTION result of a request (sec)
+HTTP_TIMEOUT = 30
+# bytes of response body read per AT+HTTPREAD
+HTTP_CHUNK = 512
+# bytes asked of the stream per read
+_READ_SIZE = 256
+# request accepted by the module, but its result did not arrive
+_NO_RESULT = object()
+
+
+class AsyncModem:
+    """ SIM808 module behind an asyncio stream pair.
+
+    Commands are serialised by a lock, so tasks may share the
+    modem; each call waits for the reply it needs and no longer.
+
+    Parameters:
+        reader (StreamReader): stream of the module output
+        writer (StreamWriter): stream to the module input
+        apn (str): access point name of the mobile data network
+    """
+
+    def __init__(self, reader, writer, apn='ETC'):
+        self.reader = reader
+        self.writer = writer
+        self.apn = apn
+        # bearer profile 1 is open, AT+HTTPINIT done
+        self.bearer_open = False
+        self.http_open = False
+        self._lock = asyncio.Lock()
+        # received bytes not consumed by a reply yet
+        self._buffer = b''
+
+    @classmethod
+    def from_uart(cls, uart, apn='ETC'):
+        """ Returns a modem over a MicroPython UART.
+        """
+        return cls(asyncio.StreamReader(uart), asyncio.StreamWriter(uart, {}), apn)
+
+    async def _write(self, data):
+        """ Sends bytes to the module.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _receive(self, deadline):
+        """ Waits for more bytes from the module, until deadline
+            (ticks_ms).
+
+        Returns:
+            (boolean) whether bytes arrived before the deadline
+        """
+        remaining = ticks_diff(deadline, ticks_ms())
+        if remaining <= 0:
+            return False
+        try:
+            data = await asyncio.wait_for(self.reader.read(_READ_SIZE), remaining / 1000)
+        except asyncio.TimeoutError:
+            return False
+        if not data:
+            raise OSError('modem stream closed')
+        self._buffer += data
+        return True
+
+    async def _read_until(self, terminators, timeout):
+        """ Reads until a line starting with one of the terminators
+            (or an error line, or a data prompt) arrives.
+
+        Returns:
+            (bytes) the reply up to the end of that line, or all
+                    that arrived if the timeout expired
+        """
+        deadline = ticks_ms() + int(timeout * 1000)
+        line_start = 0
+        while True:
+            while True:
+                end = self._buffer.find(b'\n', line_start)
+                if end < 0:
+                    break
+                line = self._buffer[line_start:end].strip()
+                line_start = end + 1
+                for final in terminators + ERROR_RESULTS:
+                    if line.startswith(final):
+                        reply = self._buffer[:line_start]
+                        self._buffer = self._buffer[line_start:]
+                        return reply
+            # a prompt is not followed by a line end
+            if self._buffer[line_start:].strip() == PROMPT:
+                break
+            if not await self._receive(deadline):
+                break
+        reply = self._buffer
+        self._buffer = b''
+        return reply
+
+    async def _read_exact(self, count, timeout):
+        """ Reads count bytes (fewer on timeout).
+        """
+        deadline = ticks_ms() + int(timeout * 1000)
+        while len(self._buffer) < count:
+            if not await self._receive(deadline):
+                break
+        data = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return data
+
+    async def _command(self, command, timeout=1, terminators=FINAL_RESULTS):
+        """ Sends an AT command and reads its reply (caller holds
+            the lock).
+        """
+        # whatever is left from an earlier reply would end this one
+        self._buffer = b''
+        if isinstance(command, str):
+            command = command.encode()
+        await self._write(command + b'\r\n')
+        reply = await self._read_until(terminators, timeout)
+        if b'DEACT' in reply:
+            self.bearer_open = False
+            self.http_open = False
+        return reply
+
+    async def command(self, command, timeout=1, terminators=FINAL_RESULTS):
+        """ Sends an AT command and returns its reply as soon as the
+            final result code (or the > data prompt) arrives.
+
+        Parameters:
+            command (str): AT command, without the line end
+            timeout (float): maximum time (sec) to wait for the reply
+            terminators (tuple): lines (prefixes) ending the reply
+                                 instead of OK and ERROR
+
+        Returns:
+            (bytes) the reply (up to the timeout if it did not end)
+        """
+        async with self._lock:
+            return await self._command(command, timeout, terminators)
+
+    async def wait_line(self, prefix, timeout):
+        """ Waits for a line starting with prefix, e.g. a result
+            code coming after OK.
+
+        Returns:
+            (bytes) the line, None on timeout or error
+        """
+        async with self._lock:
+            return await self._wait_line(prefix, timeout)
+
+    async def _wait_line(self, prefix, timeout):
+        reply = await self._read_until((prefix,), timeout)
+        if b'DEACT' in reply:
+            self.bearer_open = False
+        start = reply.find(prefix)
+        if start < 0:
+            return None
+        return reply[start:reply.find(b'\n', start)].strip()
+
+    async def register(self, timeout=60):
+        """ Waits for the module to register on the mobile network.
+
+        Parameters:
+            timeout (float): maximum time (sec) to wait
+
+        Returns:
+            (boolean) whether it is registered (home or roaming)
+        """
+        start = ticks_ms()
+        async with self._lock:
+            await self._command('AT+CFUN=1', 10)
+            while True:
+                reply = await self._command('AT+CREG?')
+                if b'+CREG: 0,1' in reply or b'+CREG: 0,5' in reply or b'+CREG: 1,1' in reply:
+                    return True
+                if ticks_diff(ticks_ms(), start) >= timeout * 1000:
+                    return False
+                await asyncio.sleep(1)
+
+    async def send_sms(self, number, text, timeout=60):
+        """ Sends a text message.
+
+        Parameters:
+            number (str): destination phone number
+            text (str): message text
+            timeout (float): maximum time (sec) to wait for the
+                             network to accept it
+
+        Returns:
+            (boolean) whether the message was sent
+        """
+        async with self._lock:
+            await self._command('AT+CMGF=1')
+            reply = await self._command('AT+CMGS="%s"' % number, 5)
+            if not reply.strip().endswith(PROMPT):
+                return False
+            await self._write(text)
+            await self._write(b'\x1a')
+            reply = await self._read_until(FINAL_RESULTS, timeout)
+            return b'+CMGS:' in reply
+
+    async def _open_http(self):
+        """ Opens the bearer and the HTTP service if they are not
+            open (see gprs.HttpSession).
+
+        Returns:
+            (boolean) whether requests can be made
+        """
+        if not self.bearer_open:
+            self.http_open = False
+            if b'+SAPBR: 1,1' not in await self._command('AT+SAPBR=2,1'):
+                await self._command('AT+SAPBR=3,1,"Contype","GPRS"')
+                await self._command('AT+SAPBR=3,1,"APN","%s"' % self.apn)
+                # may take a while on a weak network
+                await self._command('AT+SAPBR=1,1', 30)
+                if b'+SAPBR: 1,1' not in await self._command('AT+SAPBR=2,1'):
+                    return False
+            self.bearer_open = True
+        if not self.http_open:
+            if b'OK' not in await self._command('AT+HTTPINIT'):
+                # still initialised from an earlier run
+                await self._command('AT+HTTPTERM')
+                if b'OK' not in await self._command('AT+HTTPINIT'):
+                    return False
+            await self._command('AT+HTTPPARA="CID",1')
+            await self._command('AT+HTTPSSL=1')
+            self.http_open = True
+        return True
+
+    async def _read_body(self, length, timeout=10):
+        """ Reads the body of the last response with
+            AT+HTTPREAD=<offset>,<len>.
+
+        Returns:
+            (bytes) the body (shorter than length if reading failed)
+        """
+        body = bytearray()
+        while len(body) < length:
+            count = min(HTTP_CHUNK, length - len(body))
+            reply = await self._command('AT+HTTPREAD=%d,%d' % (len(body), count),
+                                        timeout, (b'+HTTPREAD:',))
+            start = reply.find(b'+HTTPREAD:')
+            if start < 0:
+                break
+            try:
+                count = int(reply[start + 10:].strip())
+            except ValueError:
+                break
+            chunk = await self._read_exact(count, timeout)
+            body.extend(chunk)
+            await self._read_until(FINAL_RESULTS, timeout)
+            if len(chunk) < count or not count:
+                break
+        return bytes(body)
+
+    async def _request(self, method, url, data, auth, content_type, timeout):
+        """ Runs one request over the open HTTP service.
+
+        Returns:
+            (tuple) HTTP status and body, None if the module refused
+                    the request, _NO_RESULT if it accepted it but did
+                    not report its result
+        """
+        await self._command('AT+HTTPPARA="URL","%s"' % url)
+        await self._command('AT+HTTPPARA="USERDATA","Connection: keep-alive"')
+        if auth is not None:
+            await self._command('AT+HTTPPARA="USERDATA","Authorization:Basic %s"' % auth)
+        if method == 'POST':
+            if isinstance(data, str):
+                data = data.encode()
+            await self._command('AT+HTTPPARA="CONTENT","%s"' % content_type)
+            reply = await self._command('AT+HTTPDATA=%d,10000' % len(data), 1, (b'DOWNLOAD',))
+            if b'DOWNLOAD' not in reply:
+                return None
+            await self._write(data)
+            await self._read_until(FINAL_RESULTS, 10)
+            reply = await self._command('AT+HTTPACTION=1')
+        else:
+            reply = await self._command('AT+HTTPACTION=0')
+        if b'OK' not in reply:
+            return None
+        line = await self._wait_line(b'+HTTPACTION:', timeout)
+        if line is None:
+            return _NO_RESULT
+        try:
+            fields = line[12:].split(b',')
+            status, length = int(fields[1]), int(fields[2])
+        except (IndexError, ValueError):
+            return _NO_RESULT
+        body = await self._read_body(length) if length else b''
+        return status, body
+
+    async def http_request(self, method, url, data=None, auth=None,
+                           content_type='application/json', timeout=HTTP_TIMEOUT):
+        """ Sends an HTTP(S) request through the module, setting the
+            bearer and HTTP service up first if needed; a request
+            refused by the module or failing with a network error
+            (6xx) is retried once, one without a result in time is
+            not (it may have reached the server).
+
+        Returns:
+            (tuple) HTTP status and body (bytes), None if both
+                    attempts failed or no result arrived in time
+        """
+        response = None
+        async with self._lock:
+            for attempt in range(2):
+                if not await self._open_http():
+                    continue
+                response = await self._request(method, url, data, auth, content_type, timeout)
+                if response is _NO_RESULT:
+                    # the module may still be busy with the request
+                    self.http_open = False
+                    return None
+                if response is not None and response[0] < 600:
+                    return response
+                self.bearer_open = False
+                self.http_open = False
+        return response
+
+    async def http_get(self, url, auth=None, timeout=HTTP_TIMEOUT):
+        """ Sends a GET request (see http_request()).
+        """
+        return await self.http_request('GET', url, auth=auth, timeout=timeout)
+
+    async def http_post(self, url, data, auth=None, content_type='application/json',
+                        timeout=HTTP_TIMEOUT):
+        """ Sends a POST request (see http_request()).
+        """
+        return await self.http_request('POST', url, data, auth, content_type, timeout)
+
+    async def close(self):
+        """ Terminates the HTTP service and closes the bearer.
+        """
+        async with self._lock:
+            if self.http_open:
+                await self._command('AT+HTTPTERM')
+            if self.bearer_open:
+                await self._command('AT+SAPBR=0,1', 10)
+            self.http_open = False
+            self.bearer_open = False
+
+
+async def open_serial(path, apn='ETC'):
+    """ Returns a modem over a serial device or pty (CPython only).
+
+    Parameters:
+        path (str): device path, e.g. the pty of a fake modem
+        apn (str): access point name of the mobile data network
+
+    Returns:
+        (AsyncModem) modem reading and writing the device
+    """
+    import os
+    loop = asyncio.get_running_loop()
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                 os.fdopen(fd, 'rb', 0))
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()),
+        os.fdopen(os.dup(fd), 'wb', 0))
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return AsyncModem(reader, writer, apn)
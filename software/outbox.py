@@ -0,0 +1,108 @@
+"""
+Reliable outbox queue on top of the database module.
+
+Records are handed out with lease() instead of being removed
+straight away. After a successful upload the lease is
+acknowledged with ack(), which removes the records in a single
+flush; after a failed upload nack() releases them, so they are
+handed out again by a later lease(). Leases only live in RAM,
+so a retry costs no flash writes at all, and records leased
+before a reboot are simply delivered again.
+
+Usage:
+    queue = Outbox(database.Database('store.db').namespace('outbox'))
+    token, records = queue.lease(4)
+    if upload(records):
+        queue.ack(token)
+    else:
+        queue.nack(token)
+"""
+
+
+class Outbox:
+    """ Queue with lease/acknowledge semantics over a Database
+        (or one of its namespaces).
+
+    Parameters:
+        database (Namespace): open database or namespace holding the records
+    """
+
+    def __init__(self, database):
+        self.database = database
+        # lease token -> record keys
+        self._leases = {}
+        # keys of every leased record
+        self._leased = set()
+        self._next_token = 0
+
+    def lease(self, count):
+        """ Hands out up to count of the oldest records that
+            are not already leased, without removing them.
+
+        Parameters:
+            count (int): maximum number of records to lease
+
+        Returns:
+            (tuple) lease token (None if nothing to lease)
+                    and the list of record values
+        """
+        records = self.database.peek(count, self._leased)
+        if not records:
+            return None, []
+        self._next_token += 1
+        token = self._next_token
+        keys = [key for key, _ in records]
+        self._leases[token] = keys
+        self._leased.update(keys)
+        return token, [value for _, value in records]
+
+    def _release(self, token):
+        """ Forgets a lease and returns its record keys
+            (None for an unknown token).
+        """
+        keys = self._leases.pop(token, None)
+        if keys is not None:
+            self._leased.difference_update(keys)
+        return keys
+
+    def ack(self, token):
+        """ Removes the records of a lease (e.g. after a
+            successful upload).
+
+        Parameters:
+            token (int): token returned by lease()
+
+        Returns:
+            status (bool): False for an unknown token
+        """
+        keys = self._release(token)
+        if keys is None:
+            return False
+        self.database.remove(keys)
+        return True
+
+    def nack(self, token):
+        """ Releases the records of a lease so they are handed
+            out again (e.g. after a failed upload).
+
+        Parameters:
+            token (int): token returned by lease()
+
+        Returns:
+            status (bool): False for an unknown token
+        """
+        return self._release(token) is not None
+
+    def nack_all(self):
+        """ Releases every outstanding lease.
+        """
+        self._leases = {}
+        self._leased = set()
+
+    def pending(self):
+        """ Returns the number of records that are not leased.
+
+        Returns:
+            (int) count of records available to lease()
+        """
+        return self.database.count() - len(self._leased)
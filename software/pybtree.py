@@ -0,0 +1,595 @@
+"""
+Pure Python implementation of the btree module API.
+
+MicroPython's btree module only exists on the device, so this
+module provides the subset database.py relies on to run (and
+be benchmarked) on CPython:
+
+    open(stream, flags=0, pagesize=0, cachesize=0, minkeypage=0)
+    db[key], db.get(key, default), db[key] = value, del db[key],
+    key in db, iter(db), db.keys/values/items(start, end, flags),
+    db.flush(), db.close(), INCL and DESC
+
+The data lives in a B+ tree stored on the stream in fixed
+size pages:
+
+    page 0      header: magic, version, page size, root page,
+                page count, head of the free page list
+    leaf        sorted (key, value) entries; values longer than
+                an eighth of a page go to a chain of overflow pages
+    internal    sorted separator keys and child page numbers
+    overflow    next page number, length and a slice of a value
+    free        next free page number
+
+Pages are read through a small cache and written back by
+flush(). Leaves that become empty are unlinked from their
+parent, but pages are not merged, so a file only shrinks
+when it is rewritten (see Database.truncate()).
+"""
+
+import struct
+
+INCL = 1
+DESC = 2
+
+_MAGIC = b'PYBT'
+_VERSION = 1
+# magic, version, page size, root, page count, free list head
+_HEADER = struct.Struct('<4sBIIII')
+_DEFAULT_PAGESIZE = 4096
+_DEFAULT_CACHESIZE = 64
+# page types
+_LEAF = 1
+_INTERNAL = 2
+_OVERFLOW = 3
+_FREE = 4
+# type, entry count
+_NODE_HEADER = struct.Struct('<BH')
+# type, next page, data length
+_OVERFLOW_HEADER = struct.Struct('<BIH')
+# key length, value length (top bit set for overflow values)
+_ENTRY = struct.Struct('<HI')
+_OVERFLOW_FLAG = 0x80000000
+
+
+def _as_key(key):
+    """ Returns a key (or value) as bytes, str is utf-8 encoded
+        like the buffer protocol does on MicroPython.
+    """
+    if isinstance(key, str):
+        return key.encode()
+    return bytes(key)
+
+
+def _bisect_left(keys, key):
+    lo, hi = 0, len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if keys[mid] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _bisect_right(keys, key):
+    lo, hi = 0, len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key < keys[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class _Overflow:
+    """ Reference to a value stored in overflow pages.
+    """
+
+    def __init__(self, page, length):
+        self.page = page
+        self.length = length
+
+
+class _Node:
+    """ In-memory form of a leaf or internal page.
+
+    Leaves hold keys and values; internal nodes hold keys and
+    len(keys) + 1 children, child i covering the keys in
+    [keys[i - 1], keys[i]).
+    """
+
+    def __init__(self, leaf, keys=None, items=None):
+        self.leaf = leaf
+        self.keys = keys or []
+        # values (leaf) or child page numbers (internal)
+        self.items = items or []
+
+    def entry_size(self, index):
+        """ Returns the number of bytes entry index takes in the page.
+        """
+        if not self.leaf:
+            return 6 + len(self.keys[index])
+        value = self.items[index]
+        if isinstance(value, _Overflow):
+            return _ENTRY.size + len(self.keys[index]) + 4
+        return _ENTRY.size + len(self.keys[index]) + len(value)
+
+    def size(self):
+        """ Returns the number of bytes of the serialized page.
+        """
+        size = _NODE_HEADER.size
+        if not self.leaf:
+            size += 4
+        for index in range(len(self.keys)):
+            size += self.entry_size(index)
+        return size
+
+    def split_index(self):
+        """ Returns the index splitting the entries into two
+            halves of about the same size.
+        """
+        half = self.size() // 2
+        size = _NODE_HEADER.size
+        for index in range(len(self.keys)):
+            size += self.entry_size(index)
+            if size >= half:
+                return min(max(index, 1), len(self.keys) - 1)
+        return len(self.keys) // 2
+
+    def pack(self, pagesize):
+        """ Returns the serialized page.
+        """
+        parts = []
+        if self.leaf:
+            parts.append(_NODE_HEADER.pack(_LEAF, len(self.keys)))
+            for key, value in zip(self.keys, self.items):
+                if isinstance(value, _Overflow):
+                    parts.append(_ENTRY.pack(len(key), value.length | _OVERFLOW_FLAG))
+                    parts.append(key)
+                    parts.append(struct.pack('<I', value.page))
+                else:
+                    parts.append(_ENTRY.pack(len(key), len(value)))
+                    parts.append(key)
+                    parts.append(value)
+        else:
+            parts.append(_NODE_HEADER.pack(_INTERNAL, len(self.keys)))
+            parts.append(struct.pack('<%dI' % len(self.items), *self.items))
+            for key in self.keys:
+                parts.append(struct.pack('<H', len(key)))
+                parts.append(key)
+        data = b''.join(parts)
+        return data + bytes(pagesize - len(data))
+
+    @staticmethod
+    def unpack(data):
+        """ Returns the node stored in a page.
+        """
+        page_type, count = _NODE_HEADER.unpack_from(data, 0)
+        pos = _NODE_HEADER.size
+        if page_type == _LEAF:
+            node = _Node(True)
+            for _ in range(count):
+                key_length, value_length = _ENTRY.unpack_from(data, pos)
+                pos += _ENTRY.size
+                node.keys.append(bytes(data[pos:pos + key_length]))
+                pos += key_length
+                if value_length & _OVERFLOW_FLAG:
+                    page = struct.unpack_from('<I', data, pos)[0]
+                    node.items.append(_Overflow(page, value_length & ~_OVERFLOW_FLAG))
+                    pos += 4
+                else:
+                    node.items.append(bytes(data[pos:pos + value_length]))
+                    pos += value_length
+            return node
+        if page_type != _INTERNAL:
+            raise OSError('corrupt btree page')
+        node = _Node(False)
+        node.items = list(struct.unpack_from('<%dI' % (count + 1), data, pos))
+        pos += 4 * (count + 1)
+        for _ in range(count):
+            key_length = struct.unpack_from('<H', data, pos)[0]
+            pos += 2
+            node.keys.append(bytes(data[pos:pos + key_length]))
+            pos += key_length
+        return node
+
+
+class _DB:
+    """ B+ tree database on a random access stream.
+    """
+
+    def __init__(self, stream, pagesize, cachesize):
+        self._stream = stream
+        # page number -> _Node, in least recently used order
+        self._cache = {}
+        self._dirty = set()
+        self._cachesize = cachesize or _DEFAULT_CACHESIZE
+        # bumped on every change so iterators know to re-seek
+        self._changes = 0
+        stream.seek(0)
+        header = stream.read(_HEADER.size)
+        if header:
+            magic, version, self._pagesize, self._root, self._pages, self._free = \
+                _HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION:
+                raise OSError('not a btree file')
+        else:
+            self._pagesize = pagesize or _DEFAULT_PAGESIZE
+            self._root = 1
+            self._pages = 2
+            self._free = 0
+            self._cache[1] = _Node(True)
+            self._dirty.add(1)
+            self._header_dirty = True
+            self.flush()
+        self._header_dirty = False
+        # keys and inline values are kept small enough for
+        # both halves of a split page to fit in a page
+        self._max_inline = self._pagesize // 8
+
+    # page access
+
+    def _read_page(self, page):
+        self._stream.seek(page * self._pagesize)
+        return self._stream.read(self._pagesize)
+
+    def _write_page(self, page, data):
+        self._stream.seek(page * self._pagesize)
+        self._stream.write(data)
+
+    def _node(self, page):
+        cache = self._cache
+        try:
+            node = cache.pop(page)
+        except KeyError:
+            node = _Node.unpack(self._read_page(page))
+            self._evict()
+        cache[page] = node
+        return node
+
+    def _evict(self):
+        """ Drops clean pages from the cache once it is full
+            (dirty pages stay until the next flush).
+        """
+        cache = self._cache
+        if len(cache) < self._cachesize:
+            return
+        for page in list(cache):
+            if page not in self._dirty:
+                del cache[page]
+                if len(cache) < self._cachesize:
+                    return
+
+    def _mark(self, page):
+        self._dirty.add(page)
+        self._changes += 1
+
+    def _allocate(self):
+        self._header_dirty = True
+        if self._free:
+            page = self._free
+            self._free = struct.unpack_from('<BI', self._read_page(page))[1]
+            return page
+        page = self._pages
+        self._pages += 1
+        return page
+
+    def _release(self, page):
+        self._cache.pop(page, None)
+        self._dirty.discard(page)
+        data = struct.pack('<BI', _FREE, self._free)
+        self._write_page(page, data + bytes(self._pagesize - len(data)))
+        self._free = page
+        self._header_dirty = True
+
+    # overflow values
+
+    def _store_value(self, value):
+        if len(value) <= self._max_inline:
+            return value
+        room = self._pagesize - _OVERFLOW_HEADER.size
+        pages = [self._allocate() for _ in range(0, len(value), room)]
+        for i, page in enumerate(pages):
+            chunk = value[i * room:(i + 1) * room]
+            next_page = pages[i + 1] if i + 1 < len(pages) else 0
+            data = _OVERFLOW_HEADER.pack(_OVERFLOW, next_page, len(chunk)) + chunk
+            self._write_page(page, data + bytes(self._pagesize - len(data)))
+        return _Overflow(pages[0], len(value))
+
+    def _load_value(self, value):
+        if not isinstance(value, _Overflow):
+            return value
+        parts = []
+        page = value.page
+        while page:
+            data = self._read_page(page)
+            _, page, length = _OVERFLOW_HEADER.unpack_from(data, 0)
+            parts.append(data[_OVERFLOW_HEADER.size:_OVERFLOW_HEADER.size + length])
+        return b''.join(parts)
+
+    def _drop_value(self, value):
+        if not isinstance(value, _Overflow):
+            return
+        page = value.page
+        while page:
+            next_page = _OVERFLOW_HEADER.unpack_from(self._read_page(page), 0)[1]
+            self._release(page)
+            page = next_page
+
+    # tree search
+
+    def _path(self, key):
+        """ Returns the [page, index] path from the root to the
+            leaf where key is or would be.
+        """
+        path = []
+        page = self._root
+        node = self._node(page)
+        while not node.leaf:
+            index = _bisect_right(node.keys, key)
+            path.append([page, index])
+            page = node.items[index]
+            node = self._node(page)
+        path.append([page, _bisect_left(node.keys, key)])
+        return path
+
+    def _descend(self, path, last):
+        """ Extends a path from its last internal entry down to
+            the first (or last) entry of a leaf.
+        """
+        page, index = path[-1]
+        node = self._node(page)
+        while not node.leaf:
+            page = node.items[index]
+            node = self._node(page)
+            index = len(node.items) - 1 if last else 0
+            path.append([page, index])
+
+    def _next(self, path):
+        """ Moves a path to the next entry; returns False at the end.
+        """
+        path[-1][1] += 1
+        while True:
+            page, index = path[-1]
+            node = self._node(page)
+            limit = len(node.keys) if node.leaf else len(node.items)
+            if index < limit:
+                if node.leaf:
+                    return True
+                self._descend(path, False)
+                continue
+            if len(path) == 1:
+                return False
+            path.pop()
+            path[-1][1] += 1
+
+    def _prev(self, path):
+        """ Moves a path to the previous entry; returns False at the start.
+        """
+        path[-1][1] -= 1
+        while True:
+            page, index = path[-1]
+            node = self._node(page)
+            if index >= 0:
+                if node.leaf:
+                    return True
+                self._descend(path, True)
+                continue
+            if len(path) == 1:
+                return False
+            path.pop()
+            path[-1][1] -= 1
+
+    def _seek(self, key, desc):
+        """ Returns a path to the first entry >= key (or to the
+            last entry when key is None and desc), None if there
+            is none.
+        """
+        if key is None:
+            if not desc:
+                path = [[self._root, -1]]
+                return path if self._next(path) else None
+            node = self._node(self._root)
+            path = [[self._root, len(node.items)]]
+            return path if self._prev(path) else None
+        path = self._path(key)
+        path[-1][1] -= 1
+        return path if self._next(path) else None
+
+    def _entry(self, path):
+        page, index = path[-1]
+        node = self._node(page)
+        return node.keys[index], node.items[index]
+
+    # mapping interface
+
+    def get(self, key, default=None):
+        key = _as_key(key)
+        page, index = self._path(key)[-1]
+        node = self._node(page)
+        if index < len(node.keys) and node.keys[index] == key:
+            return self._load_value(node.items[index])
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value):
+        key = _as_key(key)
+        value = _as_key(value)
+        if len(key) > self._max_inline:
+            raise ValueError('key too long')
+        path = self._path(key)
+        page, index = path[-1]
+        node = self._node(page)
+        if index < len(node.keys) and node.keys[index] == key:
+            self._drop_value(node.items[index])
+            node.items[index] = self._store_value(value)
+        else:
+            node.keys.insert(index, key)
+            node.items.insert(index, self._store_value(value))
+        self._mark(page)
+        self._split(path)
+
+    def _split(self, path):
+        """ Splits the nodes along a path that outgrew their page.
+        """
+        while path:
+            page = path.pop()[0]
+            node = self._node(page)
+            if node.size() <= self._pagesize:
+                return
+            middle = node.split_index()
+            right_page = self._allocate()
+            if node.leaf:
+                separator = node.keys[middle]
+                right = _Node(True, node.keys[middle:], node.items[middle:])
+                del node.keys[middle:]
+                del node.items[middle:]
+            else:
+                separator = node.keys[middle]
+                right = _Node(False, node.keys[middle + 1:], node.items[middle + 1:])
+                del node.keys[middle:]
+                del node.items[middle + 1:]
+            self._cache[right_page] = right
+            self._mark(right_page)
+            self._mark(page)
+            if not path:
+                # the root split: grow the tree by one level
+                root_page = self._allocate()
+                self._cache[root_page] = _Node(False, [separator], [page, right_page])
+                self._mark(root_page)
+                self._root = root_page
+                return
+            parent_page, index = path[-1]
+            parent = self._node(parent_page)
+            parent.keys.insert(index, separator)
+            parent.items.insert(index + 1, right_page)
+            self._mark(parent_page)
+
+    def __delitem__(self, key):
+        key = _as_key(key)
+        path = self._path(key)
+        page, index = path[-1]
+        node = self._node(page)
+        if index >= len(node.keys) or node.keys[index] != key:
+            raise KeyError(key)
+        del node.keys[index]
+        self._drop_value(node.items.pop(index))
+        self._mark(page)
+        # unlink empty pages from their parents
+        while len(path) > 1 and not self._node(path[-1][0]).items:
+            page = path.pop()[0]
+            self._release(page)
+            parent_page, index = path[-1]
+            parent = self._node(parent_page)
+            del parent.items[index]
+            if parent.keys:
+                del parent.keys[max(index - 1, 0)]
+            self._mark(parent_page)
+        # a root with a single child is replaced by the child
+        root = self._node(self._root)
+        while not root.leaf and len(root.items) == 1:
+            old_root = self._root
+            self._root = root.items[0]
+            self._release(old_root)
+            root = self._node(self._root)
+        if not root.leaf and not root.items:
+            # every leaf is gone: start again from an empty leaf
+            root.leaf = True
+            root.keys = []
+            self._mark(self._root)
+
+    # iteration
+
+    def _iter(self, start_key, end_key, flags, kind):
+        desc = flags & DESC
+        if start_key is not None:
+            start_key = _as_key(start_key)
+        if end_key is not None:
+            end_key = _as_key(end_key)
+        # like btree on MicroPython, a descending scan with a start
+        # key starts at the first key >= start_key
+        path = self._seek(start_key, desc and start_key is None)
+        changes = self._changes
+        while path is not None:
+            key, value = self._entry(path)
+            if end_key is not None:
+                if desc:
+                    stop = key < end_key or (key == end_key and not flags & INCL)
+                else:
+                    stop = key > end_key or (key == end_key and not flags & INCL)
+                if stop:
+                    return
+            if kind == 0:
+                yield key
+            elif kind == 1:
+                yield self._load_value(value)
+            else:
+                yield key, self._load_value(value)
+            if changes != self._changes:
+                # the tree changed under the iterator: find the
+                # neighbour of the last key again
+                path = self._path(key)
+                page, index = path[-1]
+                node = self._node(page)
+                found = index < len(node.keys) and node.keys[index] == key
+                if not desc and not found:
+                    path[-1][1] -= 1
+                changes = self._changes
+            moved = self._prev(path) if desc else self._next(path)
+            if not moved:
+                return
+
+    def keys(self, start_key=None, end_key=None, flags=0):
+        return self._iter(start_key, end_key, flags, 0)
+
+    def values(self, start_key=None, end_key=None, flags=0):
+        return self._iter(start_key, end_key, flags, 1)
+
+    def items(self, start_key=None, end_key=None, flags=0):
+        return self._iter(start_key, end_key, flags, 2)
+
+    def __iter__(self):
+        return self.keys()
+
+    # persistence
+
+    def flush(self):
+        for page in sorted(self._dirty):
+            self._write_page(page, self._cache[page].pack(self._pagesize))
+        self._dirty = set()
+        if self._header_dirty:
+            header = _HEADER.pack(_MAGIC, _VERSION, self._pagesize,
+                                  self._root, self._pages, self._free)
+            self._write_page(0, header + bytes(self._pagesize - len(header)))
+            self._header_dirty = False
+        self._stream.flush()
+
+    def close(self):
+        self.flush()
+
+
+def open(stream, flags=0, pagesize=0, cachesize=0, minkeypage=0):
+    """ Opens a database on a random access stream (e.g. a file
+        opened with "r+b" or "w+b").
+
+    Parameters:
+        stream (file): stream holding the database
+        flags (int): ignored, accepted for compatibility
+        pagesize (int): page size for a new database (default 4096)
+        cachesize (int): number of pages kept in memory (default 64)
+        minkeypage (int): ignored, accepted for compatibility
+
+    Returns:
+        database object
+    """
+    return _DB(stream, pagesize, cachesize)
@@ -0,0 +1,88 @@
+"""
+Receive ring buffer for the UART.
+
+The bytes are read with readinto() straight into the free space
+of a preallocated buffer, and handed out as memoryview slices of
+it, so receiving allocates nothing. fill() returns just the
+bytes that arrived, so a search for a terminator (or a parser)
+only looks at those instead of everything received so far.
+
+Usage:
+    ring = RingBuffer(1024)
+    new = ring.fill(uart)
+    parser.feed(new)
+    ring.consume(len(new))
+"""
+
+
+class RingBuffer:
+    """ Fixed size FIFO of received bytes.
+
+    Parameters:
+        size (int): capacity in bytes
+    """
+
+    def __init__(self, size=1024):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        # offset of the first unread byte
+        self._start = 0
+        # number of unread bytes
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def free(self):
+        """ Returns the number of bytes that can still be stored.
+        """
+        return len(self._buffer) - self._length
+
+    def fill(self, stream):
+        """ Reads what is available from stream (e.g. a UART) into
+            the free space following the unread bytes, up to the
+            end of the buffer.
+
+        Returns:
+            (memoryview) the bytes just read (empty if none
+                         arrived or the buffer is full)
+        """
+        size = len(self._buffer)
+        if not self._length:
+            # keep the free space in one piece
+            self._start = 0
+        end = (self._start + self._length) % size
+        stop = self._start if end < self._start else size
+        if self._length == size:
+            return self._view[end:end]
+        count = stream.readinto(self._view[end:stop])
+        if not count:
+            return self._view[end:end]
+        self._length += count
+        return self._view[end:end + count]
+
+    def data(self):
+        """ Returns the unread bytes, in at most two pieces (the
+            second one when they wrap around the end).
+
+        Returns:
+            (tuple) memoryview slices
+        """
+        size = len(self._buffer)
+        end = self._start + self._length
+        if end <= size:
+            return (self._view[self._start:end],)
+        return (self._view[self._start:], self._view[:end - size])
+
+    def consume(self, count):
+        """ Drops count bytes from the front of the unread bytes.
+        """
+        count = min(count, self._length)
+        self._start = (self._start + count) % len(self._buffer)
+        self._length -= count
+
+    def clear(self):
+        """ Drops every unread byte.
+        """
+        self._start = 0
+        self._length = 0
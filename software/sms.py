@@ -5,18 +5,15 @@ Defines functions for SMS communication
 Variables:
     SUCCESS {int} -- success
     FAILURE {int} -- failure
-    uart {[type]} -- UART object
     sms_text {str} -- SMS text
     destination_number {str} -- destination phone number
 """
 
-import time
-from machine import UART
+from modem import get_modem, FINAL_RESULTS
 
 SUCCESS = 1
 FAILURE = 0
 
-uart = UART(1, baudrate=9600, bits=8, parity=None, stop=1, rx=27, tx=14)
 sms_text = ''
 destination_number = ''
 
@@ -44,28 +41,22 @@ def init_sms(text, phone_number):
     return SUCCESS
 
 
-def send_at_command(commandString, waiting_time=0):
+def send_at_command(commandString, waiting_time=1):
     """Runs all AT Commands and returns a byte string.
 
-    This takes a mandatory command_string and optional waiting_time parameters
+    This takes a mandatory command_string and optional waiting_time parameters,
+    and returns as soon as the final result code of the command arrives.
 
     Arguments:
         command_string {str} -- AT Command string with proper closing marks
 
     Keyword Arguments:
-        waiting_time {int|float} -- waiting time for the command execution (default: {0})
+        waiting_time {int|float} -- maximum waiting time for the command execution (default: {1})
 
     Returns:
         str -- byte string
     """
-    uart.write(commandString)
-    time.sleep(waiting_time)
-    replyString = b''
-    replyChar = uart.read(1)
-    while (replyChar):
-        replyString = replyString + replyChar
-        replyChar = uart.read()
-    return replyString
+    return get_modem().command(commandString.rstrip('\r\n'), waiting_time)
 
 
 def read_sms(index=None):
@@ -86,12 +77,33 @@ def read_sms(index=None):
     set_cmgf_mode()
     msg = ''
     if index is None:
-        msg = send_at_command('AT+CMGL="ALL"\r\n', 2)
+        msg = send_at_command('AT+CMGL="ALL"\r\n', 5)
     else:
-        msg = send_at_command('AT+CMGR=%s\r\n' % index, 0.5)
+        msg = send_at_command('AT+CMGR=%s\r\n' % index, 5)
     return msg
 
 
+def on_sms_received(callback):
+    """Notify new SMS
+
+    This function registers a callback for the +CMTI
+    notification the module sends when a text message
+    arrives; it is called with the SMS index, to pass
+    to read_sms once the current command is done
+    (e.g. from the main loop, after get_modem().poll()).
+
+    Arguments:
+        callback {function} -- called with the SMS index (int)
+    """
+    def notify(line):
+        # +CMTI: "SM",<index>
+        try:
+            callback(int(line.split(b',')[-1]))
+        except ValueError:
+            pass
+    get_modem().on(b'+CMTI:', notify)
+
+
 def set_cmgf_mode(mode=1):
     """Set SMS mode
 
@@ -100,7 +112,7 @@ def set_cmgf_mode(mode=1):
     Keyword Arguments:
         mode {int} -- SMS access mode (default: {1})
     """
-    send_at_command('AT+CMGF=%s\r\n' % mode, 0.1)
+    send_at_command('AT+CMGF=%s\r\n' % mode)
 
 
 def get_cmgf_mode():
@@ -111,7 +123,7 @@ def get_cmgf_mode():
     Returns:
         bytestr -- a byte sting of current CMGF mode
     """
-    mode = send_at_command('AT+CMGF?\r\n', 0.1)
+    mode = send_at_command('AT+CMGF?\r\n')
     return mode
 
 
@@ -128,16 +140,18 @@ def send_sms():
     try:
         set_cmgf_mode()
         print(sms_text, destination_number)
-        # command to serial port uart.write('AT+CMGS="%s"\r' % destination_number)
-        # uart.write('AT+CMGS="%s"\r' % destination_number)
-        send_at_command('AT+CMGS="%s"\r' % destination_number, 0.2)
-        # command to serial port uart.write('%s' % sms_text)
-        send_at_command('%s' % sms_text, 0.2)
-        # command to serial port uart.write('\x1a')
-        send_at_command('\x1a', 4)
-        # command to serial port uart.write('\r\n')
-        send_at_command('\r\n', 1)
+        modem = get_modem()
+        # commands posted by URC handlers wait for the message
+        with modem:
+            # wait for the > prompt
+            reply = send_at_command('AT+CMGS="%s"\r' % destination_number, 5)
+            if not reply.strip().endswith(b'>'):
+                return FAILURE
+            modem.write('%s\x1a' % sms_text)
+            # +CMGS: <mr> and OK once the network took the message
+            reply = modem.read_until(FINAL_RESULTS, 60)
+        if b'+CMGS:' not in reply:
+            return FAILURE
         return SUCCESS
     except Exception as e:
         return FAILURE
-